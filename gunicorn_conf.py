@@ -0,0 +1,22 @@
+"""
+Gunicorn settings for serving server.app with Uvicorn workers.
+
+Each worker is a separate process with its own lifespan: its own HTTP clients, LLM semaphore,
+/models cache and SQLite history writer (WAL mode lets the writers share the database file).
+LLM_MAX_CONCURRENCY is therefore enforced per worker: the total cap is workers x that value.
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+# Workers are heavyweight (see above) and mostly wait on I/O, so keep the default small; on Linux
+# CPUs are counted via the scheduler affinity mask, which respects container cpusets, not the host's
+# count (sched_getaffinity doesn't exist on macOS)
+cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+workers = int(os.getenv("WEB_CONCURRENCY", min(2, cpus)))
+# uvicorn.workers is deprecated upstream; the worker class now ships as uvicorn-worker
+worker_class = "uvicorn_worker.UvicornWorker"
+keepalive = 30
+# Long LLM streams need time to finish on shutdown/redeploy
+graceful_timeout = 150
+# Heartbeat files in RAM so a slow container disk can't stall workers into timeouts
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
@@ -104,18 +104,32 @@ def embed_texts(client: OpenAI, model: str, texts: List[str]) -> List[List[float
     return [d.embedding for d in resp.data]
 
 
-def ensure_collection(qc: QdrantClient, name: str, vector_size: int):
+def quantization_config(kind: str):
+    # int8 scalar quantization keeps a 4x smaller copy of the vectors in RAM for search;
+    # originals stay on disk for rescoring
+    if kind == "int8":
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, always_ram=True)
+        )
+    return None
+
+
+def ensure_collection(qc: QdrantClient, name: str, vector_size: int, quantization: str = "int8"):
     try:
         _ = qc.get_collection(name)
         return
     except Exception:
         pass
+    quant = quantization_config(quantization)
     qc.create_collection(
         collection_name=name,
         vectors_config=models.VectorParams(
             size=vector_size,
             distance=models.Distance.COSINE,
+            # Only move the originals to disk when a quantized copy stays in RAM for search
+            on_disk=quant is not None,
         ),
+        quantization_config=quant,
     )
 
 
@@ -164,6 +178,12 @@ def main():
         "--qdrant-url", default=os.getenv("QDRANT_URL", "http://localhost:6333")
     )
     parser.add_argument("--qdrant-api-key", default=os.getenv("QDRANT_API_KEY"))
+    parser.add_argument(
+        "--quantization",
+        choices=["int8", "none"],
+        default=os.getenv("QDRANT_QUANTIZATION", "int8"),
+        help="Vector quantization for newly created collections",
+    )
     parser.add_argument(
         "--max-tokens-per-chunk",
         type=int,
@@ -214,7 +234,7 @@ def main():
     qc = QdrantClient(url=args.qdrant_url, api_key=args.qdrant_api_key)
 
     dim = infer_dim(args.embeddings_model)
-    ensure_collection(qc, args.collection, vector_size=dim)
+    ensure_collection(qc, args.collection, vector_size=dim, quantization=args.quantization)
 
     # Build chunks
     all_chunks = build_chunks(
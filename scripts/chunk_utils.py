@@ -3,6 +3,11 @@ from typing import Iterable, List
 
 import tiktoken
 
+# Compiled once: the splitters run for every paragraph/sentence of every indexed file
+PARAGRAPH_BREAK_RE = re.compile(r"\n\s*\n+")
+WHITESPACE_RE = re.compile(r"\s+")
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+
 def count_tokens(text: str, encoding_name: str = "cl100k_base") -> int:
     """Count tokens using tiktoken encoding."""
     if text is None:
@@ -12,17 +17,17 @@ def count_tokens(text: str, encoding_name: str = "cl100k_base") -> int:
 
 def split_paragraphs(text: str) -> List[str]:
     """Split text into paragraphs separated by blank lines."""
-    parts = re.split(r"\n\s*\n+", text.strip())
+    parts = PARAGRAPH_BREAK_RE.split(text.strip())
     return [p.strip() for p in parts if p and p.strip()]
 
 def split_sentences(paragraph: str) -> List[str]:
     """A simple sentence splitter that keeps punctuation.
     This is intentionally lightweight to avoid heavy dependencies.
     """
-    paragraph = re.sub(r"\s+", " ", paragraph.strip())
+    paragraph = WHITESPACE_RE.sub(" ", paragraph.strip())
     if not paragraph:
         return []
-    sentences = re.split(r"(?<=[.!?])\s+", paragraph)
+    sentences = SENTENCE_END_RE.split(paragraph)
     return [s.strip() for s in sentences if s and s.strip()]
 
 def window_sentences(
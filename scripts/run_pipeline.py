@@ -3,8 +3,11 @@ import os
 import sys
 import json
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Optional, Dict, Set, Any
+from typing import List, Optional, Dict, Set, Any, Union
 
 from dotenv import load_dotenv
 
@@ -15,7 +18,7 @@ except Exception:  # pragma: no cover
 
 try:
     from qdrant_client import QdrantClient
-    from qdrant_client.models import Filter, FieldCondition, MatchValue, MatchText
+    from qdrant_client.models import Filter, FieldCondition, MatchValue, MatchText, SearchParams, QuantizationSearchParams
 except Exception:
     QdrantClient = None  # type: ignore
 
@@ -32,6 +35,16 @@ REQUIRED_SOURCES: Set[str] = {
     "vietnam_trip_costs - Trip Cost (Audience).csv",
     "Master_Viral_Travel_Reels_Playbook.txt",
 }
+# Reasoning models: system prompt is folded into the user turn
+REASONING_MODEL_PREFIXES = ("o1", "o3", "o4", "openai/o1", "openai/o3", "openai/o4")
+# Models that don't support temperature (exact id or "<id>-<variant>")
+NO_TEMPERATURE_MODELS = frozenset({
+    "gpt-5", "gpt-5-mini",  # GPT-5 family
+    "o1", "o1-mini", "o1-pro", "o1-preview",  # OpenAI o1 models
+    "o3", "o3-mini", "o3-mini-high", "o3-pro",  # OpenAI o3 models
+    "o4-mini", "o4-mini-high",  # OpenAI o4 models
+})
+NO_TEMPERATURE_PREFIXES = tuple(f"{m}-" for m in NO_TEMPERATURE_MODELS)
 
 
 def read_text(p: Path) -> str:
@@ -44,8 +57,25 @@ def load_prompt(name: str, fallback: str = "") -> str:
     return txt if txt else fallback.strip()
 
 
+# OpenAI-compatible client, built once and reused (with its connection pool) by every
+# retrieve_context/chat_complete call; the server calls those per request
+_OPENAI_CLIENT: Optional[Any] = None
+_OPENAI_LOCK = threading.Lock()
+
+
 def get_openai_client() -> Any:
-    """Return an OpenAI-compatible client with enhanced provider support.
+    """Return the shared OpenAI-compatible client, building it on first use."""
+    global _OPENAI_CLIENT
+    if _OPENAI_CLIENT is not None:
+        return _OPENAI_CLIENT
+    with _OPENAI_LOCK:
+        if _OPENAI_CLIENT is None:
+            _OPENAI_CLIENT = _build_openai_client()
+        return _OPENAI_CLIENT
+
+
+def _build_openai_client() -> Any:
+    """Build an OpenAI-compatible client with enhanced provider support.
 
     Supports multiple modes:
     - OpenRouter proxy (preferred) using OPENROUTER_API_KEY
@@ -103,9 +133,24 @@ def get_openai_client() -> Any:
         raise RuntimeError(f"Failed to initialize OpenAI client: {e}")
 
 
+# Connected Qdrant client, reused across retrieve_context calls (the server calls it per request)
+_QDRANT_CLIENT: Optional[Any] = None
+_QDRANT_LOCK = threading.Lock()
+
+
 def get_qdrant_client() -> Optional[Any]:
+    global _QDRANT_CLIENT
     if QdrantClient is None:
         return None
+    if _QDRANT_CLIENT is not None:
+        return _QDRANT_CLIENT
+    with _QDRANT_LOCK:
+        if _QDRANT_CLIENT is None:
+            _QDRANT_CLIENT = _connect_qdrant()
+        return _QDRANT_CLIENT
+
+
+def _connect_qdrant() -> Optional[Any]:
     # Prefer docker service hostname by default so containers can reach Qdrant reliably
     url = os.getenv("QDRANT_URL", "http://qdrant:6333")
     api_key = os.getenv("QDRANT_API_KEY")
@@ -154,13 +199,14 @@ def embed(client: Any, text: str, model: str) -> List[float]:
             raise
 
 
-def retrieve_context(query: str, top_k: int = 8, trip: Optional[str] = None, persona: Optional[str] = None) -> str:
+def retrieve_context(query: str, top_k: int = 8, trip: Optional[str] = None, persona: Optional[str] = None, client: Optional[Any] = None) -> str:
     qdrant = get_qdrant_client()
     if qdrant is None:
         return ""
     collection = os.getenv("QDRANT_COLLECTION", "flowise_reels")
     emb_model = os.getenv("EMBEDDINGS_MODEL", "text-embedding-3-large")
-    client = get_openai_client()
+    # Callers with their own pooled client (the server) pass it in
+    client = client or get_openai_client()
     try:
         # 1) Try semantic search first
         vec: Optional[List[float]] = None
@@ -173,7 +219,13 @@ def retrieve_context(query: str, top_k: int = 8, trip: Optional[str] = None, per
         if vec is not None:
             try:
                 # Fetch a wider pool to allow client-side filtering; then downselect
-                points = list(qdrant.search(collection_name=collection, query_vector=vec, limit=max(top_k * 3, 24)))
+                # Quantized collections search the int8 copy, then rescore the oversampled hits with full vectors
+                points = list(qdrant.search(
+                    collection_name=collection,
+                    query_vector=vec,
+                    limit=max(top_k * 3, 24),
+                    search_params=SearchParams(quantization=QuantizationSearchParams(rescore=True, oversampling=2.0)),
+                ))
             except Exception:
                 points = []
 
@@ -203,32 +255,50 @@ def retrieve_context(query: str, top_k: int = 8, trip: Optional[str] = None, per
             t = (trip or "").lower()
             return (t in row_trip) or (t in txt) or (t in file_path)
 
+        # Point ids are derived from (file_path, chunk_index) at index time, so one set of ids
+        # keeps the scroll backfills below from re-adding chunks the semantic search already found
+        seen_ids: Set[Any] = set()
+
         for p in points:
             pl = p.payload or {}
             if matches_filters(pl):
                 line = annotate(pl)
                 if line:
+                    # Only ids actually in the context: filtered-out points stay eligible for backfill
+                    seen_ids.add(p.id)
                     chunks.append(line)
 
-        missing = [s for s in REQUIRED_SOURCES if s not in seen_sources]
-        for name in missing:
+        def scroll_source(name: str, limit: int) -> List[Any]:
             try:
-                # Fallback: scroll to get any one point from this source regardless of semantic similarity
                 filt_must = [FieldCondition(key="source_name", match=MatchValue(value=name))]
                 scrolled, _ = qdrant.scroll(
                     collection_name=collection,
-                    limit=1,
+                    limit=limit,
                     scroll_filter=Filter(must=filt_must),
                     with_payload=True,
                 )
-                if scrolled:
-                    payload = scrolled[0].payload or {}
-                    srcn = payload.get("source_name") or payload.get("file_path") or name
-                    _ = annotate(payload)  # updates seen_sources & counts
-                    line = f"SOURCE: {srcn}\n{payload.get('text') or payload.get('content') or payload.get('chunk') or ''}"
-                    chunks.append(line)
+                return scrolled or []
             except Exception:
-                pass
+                return []
+
+        # Per-source scrolls are independent round-trips: issue them concurrently so the
+        # wait is the slowest one instead of the sum, then merge results in order
+        def scroll_sources(wanted: Dict[str, int]) -> List[Any]:
+            if not wanted:
+                return []
+            with ThreadPoolExecutor(max_workers=len(wanted)) as pool:
+                return list(pool.map(scroll_source, wanted.keys(), wanted.values()))
+
+        missing = [s for s in REQUIRED_SOURCES if s not in seen_sources]
+        # Fallback: scroll to get any one point from each missing source regardless of semantic similarity
+        for name, scrolled in zip(missing, scroll_sources({name: 1 for name in missing})):
+            if scrolled:
+                seen_ids.add(scrolled[0].id)
+                payload = scrolled[0].payload or {}
+                srcn = payload.get("source_name") or payload.get("file_path") or name
+                _ = annotate(payload)  # updates seen_sources & counts
+                line = f"SOURCE: {srcn}\n{payload.get('text') or payload.get('content') or payload.get('chunk') or ''}"
+                chunks.append(line)
 
         # 3) Enforce per-source minimum quotas to improve coverage breadth
         min_quota = {
@@ -237,27 +307,18 @@ def retrieve_context(query: str, top_k: int = 8, trip: Optional[str] = None, per
             "Travel Files Directory.csv": 4,
             "vietnam_trip_costs - Trip Cost (Audience).csv": 2,
         }
-        for name, q in min_quota.items():
-            short = name
-            have = source_counts.get(short, 0)
-            need = max(0, q - have)
-            if need <= 0:
-                continue
-            try:
-                filt_must = [FieldCondition(key="source_name", match=MatchValue(value=name))]
-                scrolled, _ = qdrant.scroll(
-                    collection_name=collection,
-                    limit=need,
-                    scroll_filter=Filter(must=filt_must),
-                    with_payload=True,
-                )
-                for pt in scrolled or []:
-                    payload = pt.payload or {}
-                    line = annotate(payload)
-                    if line:
-                        chunks.append(line)
-            except Exception:
-                pass
+        # Scroll a full quota per short source: some of those points may already be in the context
+        short_of_quota = {name: q for name, q in min_quota.items() if q > source_counts.get(name, 0)}
+        for name, scrolled in zip(short_of_quota, scroll_sources(short_of_quota)):
+            for pt in scrolled:
+                if source_counts.get(name, 0) >= min_quota[name]:
+                    break
+                if pt.id in seen_ids:
+                    continue
+                line = annotate(pt.payload or {})
+                if line:
+                    seen_ids.add(pt.id)
+                    chunks.append(line)
 
         # Build a presence summary to satisfy the guard
         presence = {s: ("Present" if s in seen_sources else "Missing") for s in REQUIRED_SOURCES}
@@ -270,30 +331,17 @@ def retrieve_context(query: str, top_k: int = 8, trip: Optional[str] = None, per
 def _supports_temperature(model: str) -> bool:
     """Check if a model supports temperature parameter"""
     m = (model or "").lower().strip()
-
-    # Models that don't support temperature
-    no_temp_models = {
-        "gpt-5", "gpt-5-mini",  # GPT-5 family
-        "o1", "o1-mini", "o1-pro", "o1-preview",  # OpenAI o1 models
-        "o3", "o3-mini", "o3-mini-high", "o3-pro",  # OpenAI o3 models
-        "o4-mini", "o4-mini-high",  # OpenAI o4 models
-    }
-
     # Check for exact matches or prefixes
-    for no_temp_model in no_temp_models:
-        if m == no_temp_model or m.startswith(f"{no_temp_model}-"):
-            return False
+    return not (m in NO_TEMPERATURE_MODELS or m.startswith(NO_TEMPERATURE_PREFIXES))
 
-    return True
 
-
-def chat_complete(system: str, user: str, model: str = "gpt-4o-mini", temperature: float = 0.4) -> str:
+def chat_complete(system: str, user: str, model: str = "gpt-4o-mini", temperature: float = 0.4, client: Optional[Any] = None) -> str:
     """Enhanced chat completion with better model compatibility"""
-    client = get_openai_client()
+    client = client or get_openai_client()
 
     # Prepare messages based on model type
     messages = []
-    if model.startswith(("o1", "o3", "o4")) or model.startswith("openai/o1") or model.startswith("openai/o3") or model.startswith("openai/o4"):
+    if model.startswith(REASONING_MODEL_PREFIXES):
         # Reasoning models: combine system and user messages
         combined_content = f"System: {system}\n\nUser: {user}"
         messages = [{"role": "user", "content": combined_content}]
@@ -327,7 +375,55 @@ def chat_complete(system: str, user: str, model: str = "gpt-4o-mini", temperatur
         return f"Error: Failed to get response from {model}. {str(e)}"
 
 
-def stage_ideation(args: argparse.Namespace) -> None:
+@dataclass(slots=True)
+class PipelineArgs:
+    """Stage inputs when called in-process (the API); mirrors the CLI options of build_parser()"""
+    topic: Optional[str] = None
+    trip: Optional[str] = None
+    persona: Optional[str] = None
+    prompt: Optional[str] = None
+    script: Optional[str] = None
+    outline: Optional[str] = None
+    idea: Optional[str] = None
+    edl: Optional[str] = None
+    suno: Optional[str] = None
+    top_k: int = 8
+    model: str = "openai/gpt-5-mini"
+    temperature: float = 0.4
+    session_id: Optional[str] = None
+    # Per-run artifact directory set by the API so concurrent runs never share output files
+    out_dir: Optional[str] = None
+
+
+StageArgs = Union[argparse.Namespace, PipelineArgs]
+
+
+def stage_output(args: StageArgs, name: str) -> Path:
+    """Where a stage writes artifact `name`: the run's own out_dir if set, else out/"""
+    out_dir = getattr(args, "out_dir", None)
+    return Path(out_dir) / name if out_dir else OUT_DIR / name
+
+
+def latest_output(args: StageArgs, name: str) -> Path:
+    """Default input for a stage: this run's artifact if it has one, else the latest in out/"""
+    p = stage_output(args, name)
+    return p if p.exists() else OUT_DIR / name
+
+
+def write_output(args: StageArgs, name: str, text: str) -> None:
+    """Write a stage artifact; a per-run copy is also published to out/ (atomic replace, so
+    readers never see a partial file) to stay the latest output for later runs and the CLI"""
+    p = stage_output(args, name)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    p.write_text(text, encoding="utf-8")
+    if p.parent != OUT_DIR:
+        OUT_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = OUT_DIR / f".{name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        tmp.write_text(text, encoding="utf-8")
+        os.replace(tmp, OUT_DIR / name)
+
+
+def stage_ideation(args: StageArgs) -> None:
     # Session/memory
     session_id = getattr(args, "session_id", None)
     if session_id:
@@ -446,9 +542,8 @@ def stage_ideation(args: argparse.Namespace) -> None:
         except Exception:
             pass
     out = chat_complete(guard, user, model=args.model, temperature=args.temperature)
-    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    write_output(args, "01_ideation_and_edl.md", out)
     INITIAL_DIR.mkdir(parents=True, exist_ok=True)
-    (OUT_DIR / "01_ideation_and_edl.md").write_text(out, encoding="utf-8")
     from datetime import datetime
     ts_initial = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
     (INITIAL_DIR / f"ideation_{ts_initial}.md").write_text(out, encoding="utf-8")
@@ -473,7 +568,7 @@ def stage_ideation(args: argparse.Namespace) -> None:
     print("Wrote out/01_ideation_and_edl.md and run snapshot")
 
 
-def stage_outline(args: argparse.Namespace) -> None:
+def stage_outline(args: StageArgs) -> None:
     # Session/memory
     session_id = getattr(args, "session_id", None)
     if session_id:
@@ -566,8 +661,7 @@ def stage_outline(args: argparse.Namespace) -> None:
 
     out = chat_complete(guard, user, model=args.model, temperature=args.temperature)
 
-    OUT_DIR.mkdir(parents=True, exist_ok=True)
-    (OUT_DIR / "01a_ideation_outline.md").write_text(out, encoding="utf-8")
+    write_output(args, "01a_ideation_outline.md", out)
     INITIAL_DIR.mkdir(parents=True, exist_ok=True)
     from datetime import datetime
     ts_initial = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
@@ -600,9 +694,9 @@ def stage_outline(args: argparse.Namespace) -> None:
     print("Wrote out/01a_ideation_outline.md and run snapshot")
 
 
-def stage_edl_from_outline(args: argparse.Namespace) -> None:
+def stage_edl_from_outline(args: StageArgs) -> None:
     # Load outline
-    outline_path = Path(args.outline) if args.outline else (OUT_DIR / "01a_ideation_outline.md")
+    outline_path = Path(args.outline) if args.outline else latest_output(args, "01a_ideation_outline.md")
     outline_text = read_text(outline_path)
     if not outline_text:
         raise SystemExit("No outline provided. Run 'outline' stage first or pass --outline <path>.")
@@ -650,8 +744,7 @@ def stage_edl_from_outline(args: argparse.Namespace) -> None:
 
     out = chat_complete(guard, user, model=args.model, temperature=args.temperature)
 
-    OUT_DIR.mkdir(parents=True, exist_ok=True)
-    (OUT_DIR / "01b_edl_from_outline.md").write_text(out, encoding="utf-8")
+    write_output(args, "01b_edl_from_outline.md", out)
     INITIAL_DIR.mkdir(parents=True, exist_ok=True)
     from datetime import datetime
     ts_initial = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
@@ -676,7 +769,7 @@ def stage_edl_from_outline(args: argparse.Namespace) -> None:
     print("Wrote out/01b_edl_from_outline.md and run snapshot")
 
 
-def stage_script(args: argparse.Namespace) -> None:
+def stage_script(args: StageArgs) -> None:
     """Generate Vipin-style Hinglish script aligned to finalized outline/EDL."""
     system = load_prompt("02_script_vipinclaude.md", fallback=(
         "Write a concise Hinglish script aligned to the provided outline/EDL."
@@ -687,12 +780,12 @@ def stage_script(args: argparse.Namespace) -> None:
     outline_text = read_text(Path(args.outline)) if getattr(args, "outline", None) else ""
     edl_text = read_text(Path(args.edl)) if getattr(args, "edl", None) else ""
     if not outline_text:
-        outline_text = read_text(OUT_DIR / "01a_ideation_outline.md")
+        outline_text = read_text(latest_output(args, "01a_ideation_outline.md"))
     if not edl_text:
-        edl_text = read_text(OUT_DIR / "01b_edl_from_outline.md")
+        edl_text = read_text(latest_output(args, "01b_edl_from_outline.md"))
     if not idea_text:
         # Fall back to single-pass ideation which may include an EDL
-        idea_text = read_text(OUT_DIR / "01_ideation_and_edl.md")
+        idea_text = read_text(latest_output(args, "01_ideation_and_edl.md"))
 
     # Preferences hint
     pref_path = ROOT / "data" / "feedback" / "preferences.json"
@@ -755,8 +848,7 @@ def stage_script(args: argparse.Namespace) -> None:
 
     out = chat_complete(guard, user, model=args.model, temperature=args.temperature)
 
-    OUT_DIR.mkdir(parents=True, exist_ok=True)
-    (OUT_DIR / "02_script_vipinclaude.md").write_text(out, encoding="utf-8")
+    write_output(args, "02_script_vipinclaude.md", out)
     INITIAL_DIR.mkdir(parents=True, exist_ok=True)
     from datetime import datetime
     ts = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
@@ -779,7 +871,7 @@ def stage_script(args: argparse.Namespace) -> None:
     print("Wrote out/02_script_vipinclaude.md and run snapshot")
 
 
-def stage_suno(args: argparse.Namespace) -> None:
+def stage_suno(args: StageArgs) -> None:
     system = load_prompt("03_suno_prompt.md", fallback=(
         "You craft concise music generation prompts (genre, mood, tempo, instruments) for SUNO based on a video script. "
         "Return only the prompt, no explanations."
@@ -787,7 +879,7 @@ def stage_suno(args: argparse.Namespace) -> None:
     script_text = read_text(Path(args.script)) if args.script else ""
     if not script_text:
         try:
-            script_text = read_text(OUT_DIR / "01_ideation_and_edl.md")
+            script_text = read_text(latest_output(args, "01_ideation_and_edl.md"))
         except Exception:
             pass
     if not script_text:
@@ -805,11 +897,10 @@ def stage_suno(args: argparse.Namespace) -> None:
         pass
     user = f"Video script / summary:\n{script_text}\n\nCreate a SUNO prompt.{pref_hint}"
     out = chat_complete(system, user, model=args.model, temperature=args.temperature)
-    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    write_output(args, "03_suno_prompt.txt", out)
     INITIAL_DIR.mkdir(parents=True, exist_ok=True)
     from datetime import datetime
     ts = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
-    (OUT_DIR / "03_suno_prompt.txt").write_text(out, encoding="utf-8")
     (INITIAL_DIR / f"suno_{ts}.txt").write_text(out, encoding="utf-8")
     # snapshot debug
     RUNS_DIR.mkdir(parents=True, exist_ok=True)
@@ -822,7 +913,7 @@ def stage_suno(args: argparse.Namespace) -> None:
     print("Wrote out/03_suno_prompt.txt and run snapshot")
 
 
-def stage_handoff(args: argparse.Namespace) -> None:
+def stage_handoff(args: StageArgs) -> None:
     system = load_prompt("04_editor_handoff.md", fallback=(
         "Produce a clear editor handoff: summary, asset list, EDL with timestamps, and notes."
     ))
@@ -835,7 +926,7 @@ def stage_handoff(args: argparse.Namespace) -> None:
     # fallbacks to prior outputs
     if not pieces:
         for fn in ["01_ideation_and_edl.md", "03_suno_prompt.txt"]:
-            fp = OUT_DIR / fn
+            fp = latest_output(args, fn)
             if fp.exists():
                 pieces.append(read_text(fp))
     if not pieces:
@@ -853,11 +944,10 @@ def stage_handoff(args: argparse.Namespace) -> None:
         pass
     user = "\n\n---\n".join(pieces) + pref_hint
     out = chat_complete(system, user, model=args.model, temperature=args.temperature)
-    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    write_output(args, "04_editor_handoff.md", out)
     INITIAL_DIR.mkdir(parents=True, exist_ok=True)
     from datetime import datetime
     ts = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
-    (OUT_DIR / "04_editor_handoff.md").write_text(out, encoding="utf-8")
     (INITIAL_DIR / f"handoff_{ts}.md").write_text(out, encoding="utf-8")
     # snapshot debug
     RUNS_DIR.mkdir(parents=True, exist_ok=True)
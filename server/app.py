@@ -1,54 +1,182 @@
 from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool, iterate_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, FileResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationInfo, field_validator
+from typing import List, Dict, Any, Optional, Tuple
+from contextlib import asynccontextmanager
+from dataclasses import astuple, dataclass, replace
+from functools import lru_cache
 import os
-import json
+import re
 import sqlite3
-from datetime import datetime, timezone
+import threading
+import queue
+import time
+import asyncio
+from pathlib import Path
 import logging
+import hashlib
+import shutil
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Concurrency policy: handlers are `async def`, so anything blocking (OpenAI SDK calls, Qdrant,
+# SQLite, file reads, pipeline stages) must go through run_in_threadpool or live inside a sync
+# generator (StreamingResponse iterates those in the threadpool). Never call it directly on the loop.
+# LLM work uses run_llm / limit_llm_stream, the same offload plus the LLM_MAX_CONCURRENCY cap.
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+import anyio
 import httpx
+import orjson
 from dotenv import load_dotenv
 
 # Load environment variables at startup
 load_dotenv()
 
+# Pipeline stages and retrieval are imported once here (Qdrant/OpenAI/tiktoken load at startup, not
+# on a user's first request); without them the RAG endpoints fall back to plain chat
+try:
+    from scripts.run_pipeline import (
+        PipelineArgs,
+        chat_complete,
+        retrieve_context,
+        stage_edl_from_outline,
+        stage_ideation,
+        stage_outline,
+        stage_script,
+        stage_suno,
+    )
+    PIPELINE_AVAILABLE = True
+except ImportError as e:
+    logger.warning(f"Pipeline not available, RAG falls back to plain chat: {e}")
+    PIPELINE_AVAILABLE = False
+
 # Verify API keys are loaded
 logger.info(f"OpenRouter API Key loaded: {'Yes' if os.getenv('OPENROUTER_API_KEY') else 'No'}")
 logger.info(f"OpenAI API Key loaded: {'Yes' if os.getenv('OPENAI_API_KEY') else 'No'}")
 
-app = FastAPI(title="Reels RAG API", version="1.0.0")
+# Outbound HTTP: one pooled client per kind, shared by all requests so connections
+# to OpenRouter/OpenAI stay warm instead of paying a TCP+TLS handshake per call
+HTTP_LIMITS = httpx.Limits(max_connections=256, max_keepalive_connections=64)
+
+# Step -> system prompt file used by /rag/chat/stream
+STEP_PROMPT_FILES = {
+    'ideation': '01_ideation_and_edl.md',
+    'outline': '01a_ideation_outline.md',
+    'edl': '01b_edl_from_outline.md',
+    'script': '02_script_vipinclaude.md',
+    'suno': '03_suno_prompt.md',
+    'handoff': '04_editor_handoff.md'
+}
+DEFAULT_STEP_PROMPT = "You are a helpful assistant for travel content creation."
+
+@lru_cache(maxsize=16)
+def load_prompt(prompt_file: str) -> str:
+    """Read a prompt file once; a missing file falls back to the generic assistant prompt"""
+    try:
+        with open(f"prompts/{prompt_file}", 'r', encoding='utf-8') as f:
+            return f.read()
+    except OSError as e:
+        logger.warning(f"Could not load prompt file {prompt_file}: {e}")
+        return DEFAULT_STEP_PROMPT
+
+# /models payload cache: the OpenRouter catalog changes rarely, so serve it from memory for a while
+MODELS_CACHE_TTL = float(os.getenv("MODELS_CACHE_TTL", "300"))
+MODELS_FALLBACK_TTL = 30.0
+MODELS_CACHE: Dict[str, Any] = {"exp": 0.0, "data": None, "etag": None}
+MODELS_REFRESH_MARGIN = 5.0
+
+# Cap on concurrent outbound LLM work (chat calls, streams, pipeline stages) so a burst of requests
+# queues here instead of opening a socket per request and tripping provider rate limits.
+# Enforced per worker process: under gunicorn the total is WEB_CONCURRENCY x this value
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_METRICS = {"in_flight": 0, "waiting": 0}
+# AnyIO worker threads behind run_in_threadpool/iterate_in_threadpool. Every in-flight LLM call or
+# stream holds one for its whole duration, so leave room above the LLM cap for SQLite/file work
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", str(max(64, LLM_MAX_CONCURRENCY + 32))))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    # Read step prompts up front so streamed requests never touch the disk for them
+    for prompt_file in set(STEP_PROMPT_FILES.values()):
+        load_prompt(prompt_file)
+    app.state.http = httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=10.0), limits=HTTP_LIMITS)
+    # The OpenAI SDK is called synchronously (threadpool), so it gets a sync client
+    app.state.llm_http = httpx.Client(timeout=httpx.Timeout(120.0, connect=10.0), limits=HTTP_LIMITS)
+    # Keys are read once at startup; restart the server after changing them in .env
+    app.state.openrouter = OpenRouterConfig.from_env()
+    app.state.llm = build_openai_client(app.state.openrouter, app.state.llm_http)
+    app.state.llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    app.state.models_lock = asyncio.Lock()
+    # Prefetched /rag/chat/stream retrievals; kept apart from the AnyIO pool the streams themselves use
+    app.state.retrieval_pool = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY, thread_name_prefix="retrieval")
+    # Warm the /models cache in the background and keep refreshing it, so neither the first UI load
+    # nor the one after an expiry waits on OpenRouter (with caching disabled, just warm it once)
+    prewarm = asyncio.create_task(models_refresher() if MODELS_CACHE_TTL > 0 else cached_models())
+    writer = threading.Thread(target=history_writer, name="history-writer", daemon=True)
+    writer.start()
+    try:
+        yield
+    finally:
+        prewarm.cancel()
+        # Flush queued history before exiting: the sentinel lands behind any pending rows
+        HISTORY_QUEUE.put(None)
+        await run_in_threadpool(writer.join, 5.0)
+        await app.state.http.aclose()
+        app.state.llm_http.close()
+        app.state.retrieval_pool.shutdown(wait=False, cancel_futures=True)
+
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered by orjson, which encodes the dict/list payloads (history, model
+    catalog) far faster than stdlib json. Defined here because FastAPI's own copy is deprecated."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+app = FastAPI(title="Reels RAG API", version="1.0.0", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Add CORS middleware to allow frontend requests
+# Pipeline artifacts and history pages are large, highly compressible text. SSE streams are left
+# alone: Starlette >= 0.46 (pinned in requirements.txt) skips text/event-stream, and they carry
+# no-transform for proxies
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=[
-        "http://localhost:3000",
-        "http://localhost:3001", 
-        "https://localhost:3000",
-        "https://localhost:3001",
-        "http://127.0.0.1:3000",
-        "http://127.0.0.1:3001",
-        "https://*.app.github.dev",
-        "http://web:3000",
-    ],
+    # One compiled pattern instead of a list scan per request: local dev ports and the compose
+    # web service. The old "https://*.app.github.dev" entry was matched literally (never matched
+    # anything) and a wildcard would admit every Codespace with credentials, so it is left out
+    allow_origin_regex=r"https?://(localhost|127\.0\.0\.1):(3000|3001)|http://web:3000",
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    # Exact lists (the web client sends Idempotency-Key on pipeline calls) plus a long max_age so
+    # browsers cache the preflight instead of sending an OPTIONS before every POST
+    allow_methods=["GET", "POST"],
+    allow_headers=["Authorization", "Content-Type", "Idempotency-Key"],
+    max_age=86400,
 )
 
 # Database setup
 SQLITE_PATH = os.getenv("SQLITE_PATH", "database.sqlite")
 
-def init_db():
-    """Initialize SQLite database for chat history"""
-    conn = sqlite3.connect(SQLITE_PATH)
+def init_db() -> sqlite3.Connection:
+    """Initialize SQLite database for chat history and return the shared connection"""
+    # One connection for the whole process (guarded by DB_LOCK) instead of a connect per request;
+    # WAL + synchronous=NORMAL keeps commits cheap and lets other workers read while one writes
+    conn = sqlite3.connect(SQLITE_PATH, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    # Keep recent history hot: 64 MiB page cache, 256 MiB mmap, temp b-trees in memory
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA cache_size=-65536")
     cursor = conn.cursor()
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS chat_history (
@@ -62,11 +190,25 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """)
+    # Indexes for /history lookups (by session, optionally filtered by step, newest first)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chat_history_session_ts
+        ON chat_history(session_id, ts)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chat_history_session_step_ts
+        ON chat_history(session_id, step, ts)
+    """)
+    # Refresh planner stats so the step query keeps picking the (session_id, step, ts) index;
+    # analysis_limit samples each index instead of scanning a large table on every startup
+    cursor.execute("PRAGMA analysis_limit=400")
+    cursor.execute("ANALYZE chat_history")
     conn.commit()
-    conn.close()
+    return conn
 
 # Initialize database on startup
-init_db()
+DB = init_db()
+DB_LOCK = threading.Lock()
 
 # Pydantic models
 class ChatMessage(BaseModel):
@@ -98,39 +240,65 @@ class PipelineRequest(BaseModel):
     edl: Optional[str] = None
     script: Optional[str] = None
     suno: Optional[str] = None
-    top_k: Optional[int] = 8
-    model: Optional[str] = None
-    temperature: Optional[float] = 0.4
+    # Stage defaults live here so validation fills them in; handlers pass the model straight through
+    top_k: int = 8
+    model: str = "openai/gpt-5-mini"
+    temperature: float = 0.4
     session_id: Optional[str] = None
     step: Optional[str] = None
 
+    @field_validator("top_k", "model", "temperature", mode="before")
+    @classmethod
+    def default_when_blank(cls, value: Any, info: ValidationInfo) -> Any:
+        """Treat null (and an empty model name) as unset, as the old `or default` handlers did"""
+        if value is None or value == "":
+            return cls.model_fields[info.field_name].default
+        return value
+
 # OpenRouter/OpenAI client setup
-def get_openai_client():
-    """Get OpenAI-compatible client with OpenRouter primary, OpenAI fallback"""
-    # Reload environment variables to ensure they're fresh
-    load_dotenv()
-    
+# OpenRouter attribution headers, read once; sent with catalog fetches and SDK calls alike
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+OPENROUTER_HEADERS = {
+    name: value
+    for name, value in (("HTTP-Referer", os.getenv("OPENROUTER_SITE_URL", "")), ("X-Title", os.getenv("OPENROUTER_APP_NAME", "")))
+    if value
+}
+
+@dataclass(frozen=True)
+class OpenRouterConfig:
+    """OpenRouter key and catalog request headers, read from the environment once in the lifespan"""
+    api_key: str
+    catalog_headers: Dict[str, str]
+
+    @classmethod
+    def from_env(cls) -> "OpenRouterConfig":
+        api_key = os.getenv("OPENROUTER_API_KEY", "").strip()
+        return cls(
+            api_key=api_key,
+            catalog_headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json",
+                **OPENROUTER_HEADERS
+            },
+        )
+
+def build_openai_client(config: OpenRouterConfig, http_client: Optional[httpx.Client] = None):
+    """OpenAI-compatible client with OpenRouter primary, OpenAI fallback; None when no key works"""
     # Try OpenRouter first
-    or_key = os.getenv("OPENROUTER_API_KEY", "").strip()
+    or_key = config.api_key
     logger.info(f"Attempting OpenRouter with key: {or_key[:10]}..." if or_key else "No OpenRouter key found")
     
     if or_key:
         try:
             from openai import OpenAI
-            base_url = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
-            headers = {}
-            if os.getenv("OPENROUTER_SITE_URL"):
-                headers["HTTP-Referer"] = os.getenv("OPENROUTER_SITE_URL")
-            if os.getenv("OPENROUTER_APP_NAME"):
-                headers["X-Title"] = os.getenv("OPENROUTER_APP_NAME")
-            
-            logger.info(f"Creating OpenRouter client with base_url: {base_url}")
+            logger.info(f"Creating OpenRouter client with base_url: {OPENROUTER_BASE_URL}")
             return OpenAI(
-                base_url=base_url,
+                base_url=OPENROUTER_BASE_URL,
                 api_key=or_key,
-                default_headers=headers or None,
+                default_headers=OPENROUTER_HEADERS or None,
                 timeout=120.0,
-                max_retries=5
+                max_retries=5,
+                http_client=http_client
             )
         except Exception as e:
             logger.error(f"OpenRouter client failed: {e}")
@@ -142,317 +310,539 @@ def get_openai_client():
     if openai_key:
         try:
             from openai import OpenAI
-            return OpenAI(api_key=openai_key, timeout=120.0, max_retries=5)
+            return OpenAI(api_key=openai_key, timeout=120.0, max_retries=5, http_client=http_client)
         except Exception as e:
             logger.error(f"OpenAI client failed: {e}")
     
     logger.error("No valid API keys found in environment")
-    raise HTTPException(status_code=500, detail="No valid API keys configured. Please check OPENROUTER_API_KEY or OPENAI_API_KEY in .env file")
+    return None
+
+def get_openai_client():
+    """The LLM client built once in the lifespan; requests share it and its warm connection pool"""
+    client = getattr(app.state, "llm", None)
+    if client is None:
+        raise HTTPException(status_code=500, detail="No valid API keys configured. Please check OPENROUTER_API_KEY or OPENAI_API_KEY in .env file")
+    return client
+
+# OpenRouter model ids flagged as recommended in /models
+RECOMMENDED_MODELS = frozenset({
+    # 🚀 Latest 2025 Models (Highest Priority)
+    # ChatGPT-5 series
+    "openai/gpt-5",
+    "openai/gpt-5-mini",
+    "openai/gpt-5-turbo",
+    "openai/gpt-5-pro",
+    "openai/chatgpt-5",
+    "openai/o1-pro",
+    "openai/o1-max",
+    "openai/o1-preview-2025",
+
+    # Claude 4 series
+    "anthropic/claude-4",
+    "anthropic/claude-4-sonnet",
+    "anthropic/claude-4-opus",
+    "anthropic/claude-4-haiku",
+    "anthropic/claude-3.5-sonnet-20250101",
+    "anthropic/claude-3.5-opus",
+
+    # Gemini 2.5/3.0 series
+    "google/gemini-2.5-pro",
+    "google/gemini-2.5-flash",
+    "google/gemini-3.0-pro",
+    "google/gemini-3.0-flash",
+    "google/gemini-2.0-flash-thinking",
+
+    # Llama 4 series
+    "meta-llama/llama-4",
+    "meta-llama/llama-3.3",
+    "meta-llama/llama-3.2-405b",
+    "meta-llama/llama-3.2-90b",
+
+    # Other 2025 models
+    "xai/grok-3",
+    "xai/grok-2.5",
+    "cohere/command-r-08-2025",
+    "mistralai/mixtral-8x22b-instruct-v0.3",
+
+    # 📈 High Priority 2024 Models
+    # OpenAI
+    "openai/gpt-4o",
+    "openai/gpt-4o-mini",
+    "openai/gpt-4-turbo",
+    "openai/o1",
+    "openai/o1-mini",
+    "openai/o1-preview",
+    # Anthropic
+    "anthropic/claude-3.5-sonnet",
+    "anthropic/claude-3.5-haiku",
+    "anthropic/claude-3-opus",
+    # Google
+    "google/gemini-2.0-flash-exp",
+    "google/gemini-exp-1206",
+    "google/gemini-pro",
+    "google/gemini-1.5-pro",
+    # Meta
+    "meta-llama/llama-3.1-405b-instruct",
+    "meta-llama/llama-3.1-70b-instruct",
+    "meta-llama/llama-3.1-8b-instruct",
+    # xAI
+    "xai/grok-2",
+    "xai/grok-beta",
+    # Cohere
+    "cohere/command-r-plus",
+    # Mistral
+    "mistralai/mixtral-8x7b-instruct",
+    "mistralai/mistral-large",
+})
+
+# Model id substrings that mark a 2025-generation model
+LATEST_2025_PATTERNS = (
+    'gpt-5', 'chatgpt-5', 'o1-pro', 'o1-max', 'o1-preview-2025',
+    'claude-4', 'claude-3.5-sonnet-2025', 'claude-3.5-opus',
+    'gemini-2.5', 'gemini-3.0', 'gemini-2.0-flash-thinking',
+    'llama-4', 'llama-3.3', 'llama-3.2-405b', 'llama-3.2-90b',
+    'grok-3', 'grok-2.5', 'command-r-08-2025', 'mixtral-8x22b-instruct-v0.3'
+)
+# One alternation scan per model id instead of a substring test per pattern
+LATEST_2025_RE = re.compile("|".join(map(re.escape, LATEST_2025_PATTERNS)))
 
-async def fetch_openrouter_models():
+# Display name for the provider prefix of an OpenRouter model id; unknown prefixes are title-cased
+PROVIDER_MAP = {
+    "openai": "OpenAI",
+    "anthropic": "Anthropic",
+    "google": "Google",
+    "meta-llama": "Meta",
+    "meta": "Meta",
+    "xai": "xAI",
+    "mistralai": "Mistral",
+    "mistral": "Mistral",
+    "cohere": "Cohere",
+    "aws": "AWS",
+    "amazon": "AWS",
+    "nvidia": "NVIDIA",
+    "huggingface": "Hugging Face",
+    "hf": "Hugging Face",
+    "qwen": "Alibaba",
+    "deepseek": "DeepSeek",
+    "01-ai": "01.AI",
+}
+
+# /models sort order by lowercased provider name; anything else sorts after these
+PROVIDER_PRIORITY = {
+    "openai": 1,
+    "anthropic": 2,
+    "google": 3,
+    "meta": 4,
+    "xai": 5,
+    "mistral": 6,
+    "cohere": 7,
+    "aws": 8,
+    "nvidia": 9,
+    "huggingface": 10
+}
+
+async def fetch_openrouter_models(config: OpenRouterConfig, client: httpx.AsyncClient):
     """Fetch models from OpenRouter API with enhanced provider detection and prioritization"""
-    openrouter_api_key = os.getenv("OPENROUTER_API_KEY", "").strip()
-    if not openrouter_api_key:
+    if not config.api_key:
         logger.warning("No OpenRouter API key found for model fetching")
         return []
     
     try:
-        openrouter_base_url = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
-        openrouter_site_url = os.getenv("OPENROUTER_SITE_URL", "")
-        openrouter_app_name = os.getenv("OPENROUTER_APP_NAME", "")
-        
-        headers = {
-            "Authorization": f"Bearer {openrouter_api_key}",
-            "Content-Type": "application/json"
-        }
-        if openrouter_site_url:
-            headers["HTTP-Referer"] = openrouter_site_url
-        if openrouter_app_name:
-            headers["X-Title"] = openrouter_app_name
+        response = await client.get(f"{OPENROUTER_BASE_URL}/models", headers=config.catalog_headers)
+        response.raise_for_status()
+        # Proxies/CDNs occasionally answer with an HTML page; check the first bytes instead of decoding the body
+        if response.content[:15].lstrip().lower().startswith((b"<!doctype", b"<html")):
+            logger.error(f"OpenRouter returned HTML instead of JSON: {response.text[:200]}")
+            return []
+        # orjson decodes the raw body bytes directly (no str round-trip); its errors subclass ValueError
+        data = orjson.loads(response.content)
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(f"{openrouter_base_url}/models", headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            
-            models = []
-            if "data" in data:
-                # Define provider priority and recommended models
-                provider_priority = {
-                    "openai": 1,
-                    "anthropic": 2, 
-                    "google": 3,
-                    "meta": 4,
-                    "xai": 5,
-                    "mistral": 6,
-                    "cohere": 7,
-                    "aws": 8,
-                    "nvidia": 9,
-                    "huggingface": 10
-                }
+        models = []
+        if isinstance(data, dict) and isinstance(data.get("data"), list):
+            for model in data["data"]:
+                # Skip malformed catalog entries rather than failing the whole fetch
+                if not isinstance(model, dict) or not isinstance(model.get("id", ""), str):
+                    continue
+                model_id = model.get("id", "")
                 
-                recommended_models = {
-                    # 🚀 Latest 2025 Models (Highest Priority)
-                    # ChatGPT-5 series
-                    "openai/gpt-5": True,
-                    "openai/gpt-5-mini": True,
-                    "openai/gpt-5-turbo": True,
-                    "openai/gpt-5-pro": True,
-                    "openai/chatgpt-5": True,
-                    "openai/o1-pro": True,
-                    "openai/o1-max": True,
-                    "openai/o1-preview-2025": True,
-                    
-                    # Claude 4 series  
-                    "anthropic/claude-4": True,
-                    "anthropic/claude-4-sonnet": True,
-                    "anthropic/claude-4-opus": True,
-                    "anthropic/claude-4-haiku": True,
-                    "anthropic/claude-3.5-sonnet-20250101": True,
-                    "anthropic/claude-3.5-opus": True,
-                    
-                    # Gemini 2.5/3.0 series
-                    "google/gemini-2.5-pro": True,
-                    "google/gemini-2.5-flash": True,
-                    "google/gemini-3.0-pro": True,
-                    "google/gemini-3.0-flash": True,
-                    "google/gemini-2.0-flash-thinking": True,
-                    
-                    # Llama 4 series
-                    "meta-llama/llama-4": True,
-                    "meta-llama/llama-3.3": True,
-                    "meta-llama/llama-3.2-405b": True,
-                    "meta-llama/llama-3.2-90b": True,
-                    
-                    # Other 2025 models
-                    "xai/grok-3": True,
-                    "xai/grok-2.5": True,
-                    "cohere/command-r-08-2025": True,
-                    "mistralai/mixtral-8x22b-instruct-v0.3": True,
-                    
-                    # 📈 High Priority 2024 Models
-                    # OpenAI
-                    "openai/gpt-4o": True,
-                    "openai/gpt-4o-mini": True,
-                    "openai/gpt-4-turbo": True,
-                    "openai/o1": True,
-                    "openai/o1-mini": True,
-                    "openai/o1-preview": True,
-                    # Anthropic
-                    "anthropic/claude-3.5-sonnet": True,
-                    "anthropic/claude-3.5-haiku": True,
-                    "anthropic/claude-3-opus": True,
-                    # Google
-                    "google/gemini-2.0-flash-exp": True,
-                    "google/gemini-exp-1206": True,
-                    "google/gemini-pro": True,
-                    "google/gemini-1.5-pro": True,
-                    # Meta
-                    "meta-llama/llama-3.1-405b-instruct": True,
-                    "meta-llama/llama-3.1-70b-instruct": True,
-                    "meta-llama/llama-3.1-8b-instruct": True,
-                    # xAI
-                    "xai/grok-2": True,
-                    "xai/grok-beta": True,
-                    # Cohere
-                    "cohere/command-r-plus": True,
-                    # Mistral
-                    "mistralai/mixtral-8x7b-instruct": True,
-                    "mistralai/mistral-large": True
-                }
+                # Enhanced provider detection
+                provider = "Unknown"
+                if "/" in model_id:
+                    provider_part = model_id.split("/", 1)[0].lower()
+                    provider = PROVIDER_MAP.get(provider_part) or provider_part.title()
                 
-                for model in data["data"]:
-                    model_id = model.get("id", "")
-                    
-                    # Enhanced provider detection
-                    provider = "Unknown"
-                    if "/" in model_id:
-                        provider_part = model_id.split("/")[0].lower()
-                        if provider_part in ["openai"]:
-                            provider = "OpenAI"
-                        elif provider_part in ["anthropic"]:
-                            provider = "Anthropic"
-                        elif provider_part in ["google"]:
-                            provider = "Google"
-                        elif provider_part in ["meta-llama", "meta"]:
-                            provider = "Meta"
-                        elif provider_part in ["xai"]:
-                            provider = "xAI"
-                        elif provider_part in ["mistralai", "mistral"]:
-                            provider = "Mistral"
-                        elif provider_part in ["cohere"]:
-                            provider = "Cohere"
-                        elif provider_part in ["aws", "amazon"]:
-                            provider = "AWS"
-                        elif provider_part in ["nvidia"]:
-                            provider = "NVIDIA"
-                        elif provider_part in ["huggingface", "hf"]:
-                            provider = "Hugging Face"
-                        elif provider_part in ["qwen"]:
-                            provider = "Alibaba"
-                        elif provider_part in ["deepseek"]:
-                            provider = "DeepSeek"
-                        elif provider_part in ["01-ai"]:
-                            provider = "01.AI"
-                        else:
-                            # Capitalize first letter of unknown providers
-                            provider = provider_part.title()
-                    
-                    # Check if model is free (some OpenRouter models are free)
-                    pricing = model.get("pricing", {})
-                    prompt_cost = float(pricing.get("prompt", "0"))
-                    completion_cost = float(pricing.get("completion", "0"))
-                    is_free = prompt_cost == 0 and completion_cost == 0
-                    
-                    # Check if model is recommended
-                    is_recommended = model_id in recommended_models
-                    
-                    # Check if it's a 2025 model based on model ID patterns
-                    latest_2025_patterns = [
-                        'gpt-5', 'chatgpt-5', 'o1-pro', 'o1-max', 'o1-preview-2025',
-                        'claude-4', 'claude-3.5-sonnet-2025', 'claude-3.5-opus',
-                        'gemini-2.5', 'gemini-3.0', 'gemini-2.0-flash-thinking',
-                        'llama-4', 'llama-3.3', 'llama-3.2-405b', 'llama-3.2-90b',
-                        'grok-3', 'grok-2.5', 'command-r-08-2025', 'mixtral-8x22b-instruct-v0.3'
-                    ]
-                    
-                    is_2025_model = any(pattern in model_id.lower() for pattern in latest_2025_patterns)
-                    
-                    # Create enhanced label with special markers
-                    base_label = model.get("name", model_id)
-                    if is_2025_model:
-                        enhanced_label = f"🚀 {base_label}"
-                    elif is_recommended:
-                        enhanced_label = f"⭐ {base_label}"
-                    else:
-                        enhanced_label = base_label
-                    
-                    model_item = {
-                        "id": model_id,
-                        "provider": provider,
-                        "label": enhanced_label,
-                        "free": is_free,
-                        "paid": not is_free,
-                        "recommended": is_recommended,
-                        "is_2025_model": is_2025_model,
-                        "context_length": model.get("context_length", 0),
-                        "pricing": {
-                            "prompt": prompt_cost,
-                            "completion": completion_cost
-                        }
-                    }
-                    models.append(model_item)
+                # Check if model is free (some OpenRouter models are free)
+                pricing = model.get("pricing")
+                if not isinstance(pricing, dict):
+                    pricing = {}
+                prompt_cost = float(pricing.get("prompt") or 0)
+                completion_cost = float(pricing.get("completion") or 0)
+                is_free = prompt_cost == 0 and completion_cost == 0
                 
-                # Sort models by priority: 2025 models first, then recommended, then by provider priority, then by name
-                def sort_key(model):
-                    provider_name = model["provider"].lower()
-                    provider_rank = provider_priority.get(provider_name, 999)
-                    is_2025_rank = 0 if model.get("is_2025_model", False) else 1
-                    recommended_rank = 0 if model["recommended"] else 1
-                    return (is_2025_rank, recommended_rank, provider_rank, model["label"].lower())
+                # Check if model is recommended
+                is_recommended = model_id in RECOMMENDED_MODELS
                 
-                models.sort(key=sort_key)
+                # Check if it's a 2025 model based on model ID patterns
+                is_2025_model = LATEST_2025_RE.search(model_id.lower()) is not None
                 
-                logger.info(f"Successfully fetched {len(models)} models from OpenRouter")
-                return models
+                # Create enhanced label with special markers
+                base_label = model.get("name") or model_id
+                if is_2025_model:
+                    enhanced_label = f"🚀 {base_label}"
+                elif is_recommended:
+                    enhanced_label = f"⭐ {base_label}"
+                else:
+                    enhanced_label = base_label
                 
-    except Exception as e:
+                model_item = {
+                    "id": model_id,
+                    "provider": provider,
+                    "label": enhanced_label,
+                    "free": is_free,
+                    "paid": not is_free,
+                    "recommended": is_recommended,
+                    "is_2025_model": is_2025_model,
+                    "context_length": model.get("context_length", 0),
+                    "pricing": {
+                        "prompt": prompt_cost,
+                        "completion": completion_cost
+                    }
+                }
+                models.append(model_item)
+            
+            # Sort models by priority: 2025 models first, then recommended, then by provider priority, then by name
+            def sort_key(model):
+                provider_name = model["provider"].lower()
+                provider_rank = PROVIDER_PRIORITY.get(provider_name, 999)
+                is_2025_rank = 0 if model.get("is_2025_model", False) else 1
+                recommended_rank = 0 if model["recommended"] else 1
+                return (is_2025_rank, recommended_rank, provider_rank, model["label"].lower())
+            
+            models.sort(key=sort_key)
+            
+            logger.info(f"Successfully fetched {len(models)} models from OpenRouter")
+            return models
+            
+    except (httpx.HTTPError, ValueError) as e:
         logger.error(f"Failed to fetch models from OpenRouter: {e}")
         return []
 
+SOURCE_LINE_RE = re.compile(r"^SOURCE:(.*)$", re.MULTILINE)
+
+def extract_citations(context: str) -> List[Dict[str, str]]:
+    """Build the citation list from the SOURCE: lines of a retrieved context"""
+    citations = []
+    seen = set()
+    for match in SOURCE_LINE_RE.finditer(context or ""):
+        source_name = match.group(1).strip()
+        if source_name not in seen:
+            seen.add(source_name)
+            citations.append({
+                "source": source_name,
+                "title": source_name.split('/')[-1],
+                "excerpt": ""
+            })
+    return citations
+
+# Pre-encoded SSE event prefixes; frames are assembled as bytes so StreamingResponse skips the encode step
+SSE_CONTEXT = b"event: context\ndata: "
+SSE_MESSAGE = b"event: message\ndata: "
+SSE_USAGE = b"event: usage\ndata: "
+SSE_DONE = b"event: done\ndata: "
+SSE_ERROR = b"event: error\ndata: "
+SSE_STAGE = b"event: stage\ndata: "
+# Stop nginx-style proxies and caches from holding frames back or re-encoding them
+SSE_HEADERS = {"Cache-Control": "no-cache, no-transform", "X-Accel-Buffering": "no"}
+
+def sse_format(prefix: bytes, data: Any) -> bytes:
+    """Serialize one SSE frame with orjson (UTF-8 bytes, no ensure_ascii pass)"""
+    return b"".join((prefix, orjson.dumps(data), b"\n\n"))
+
+async def batch_sse_frames(frames, max_delay: float = 0.01, max_bytes: int = 4096):
+    """Coalesce message frames from an async frame iterator into chunks of up to max_delay.
+
+    A held message frame is flushed by its deadline even if the LLM stalls before the next one;
+    anything other than a message frame (context/usage/done/error) flushes immediately.
+    """
+    frames = frames.__aiter__()
+    buf = bytearray()
+    last_flush = time.monotonic()
+    deadline: Optional[float] = None
+    pending: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(frames.__anext__())
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            # asyncio.wait (unlike wait_for) leaves the pending read running when it times out
+            done, _ = await asyncio.wait((pending,), timeout=timeout)
+            if not done:
+                yield bytes(buf)
+                buf.clear()
+                last_flush, deadline = time.monotonic(), None
+                continue
+            task, pending = pending, None
+            try:
+                frame = task.result()
+            except StopAsyncIteration:
+                break
+            buf += frame
+            now = time.monotonic()
+            if not frame.startswith(SSE_MESSAGE) or now - last_flush >= max_delay or len(buf) >= max_bytes:
+                yield bytes(buf)
+                buf.clear()
+                last_flush, deadline = now, None
+            elif deadline is None:
+                deadline = last_flush + max_delay
+        if buf:
+            yield bytes(buf)
+    finally:
+        # Client went away mid-stream: stop the in-flight read so the LLM slot is released
+        if pending is not None:
+            pending.cancel()
+            await asyncio.wait((pending,))
+
+def iter_completion_deltas(stream, usage: Dict[str, int]):
+    """Yield the content deltas of a streamed chat completion.
+
+    With stream_options include_usage the final chunk has no choices and carries token usage;
+    its counts are copied into `usage`.
+    """
+    for chunk in stream:
+        if chunk.usage:
+            usage["prompt_tokens"] = chunk.usage.prompt_tokens
+            usage["completion_tokens"] = chunk.usage.completion_tokens
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+@asynccontextmanager
+async def llm_slot():
+    """Hold one of the LLM_MAX_CONCURRENCY slots, tracking in-flight/waiting counts for /metrics"""
+    LLM_METRICS["waiting"] += 1
+    try:
+        await app.state.llm_semaphore.acquire()
+    finally:
+        LLM_METRICS["waiting"] -= 1
+    LLM_METRICS["in_flight"] += 1
+    try:
+        yield
+    finally:
+        LLM_METRICS["in_flight"] -= 1
+        app.state.llm_semaphore.release()
+
+async def run_llm(func, *args, **kwargs):
+    """run_in_threadpool for blocking LLM work, bounded by llm_slot()"""
+    async with llm_slot():
+        return await run_in_threadpool(func, *args, **kwargs)
+
+async def limit_llm_stream(frames):
+    """Iterate a blocking SSE generator in the threadpool while holding an LLM slot for its lifetime"""
+    async with llm_slot():
+        async for frame in iterate_in_threadpool(frames):
+            yield frame
+
+# Exact-match response cache for /chat and /rag/chat: identical (model, temperature, input) requests
+# are answered from memory instead of re-running retrieval + the LLM. Off unless RESPONSE_CACHE_TTL > 0,
+# since generation is sampled and a repeated prompt may be a deliberate "try again".
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "0"))
+RESPONSE_CACHE_SIZE = 512
+RESPONSE_CACHE: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+def response_cache_key(*parts: Any) -> str:
+    return hashlib.sha1(orjson.dumps(parts)).hexdigest()
+
+def response_cache_get(key: str) -> Optional[Dict[str, Any]]:
+    entry = RESPONSE_CACHE.get(key)
+    if entry is None:
+        return None
+    expires, value = entry
+    if time.monotonic() >= expires:
+        del RESPONSE_CACHE[key]
+        return None
+    RESPONSE_CACHE.move_to_end(key)
+    return value
+
+def response_cache_put(key: str, value: Dict[str, Any]):
+    if RESPONSE_CACHE_TTL <= 0:
+        return
+    RESPONSE_CACHE[key] = (time.monotonic() + RESPONSE_CACHE_TTL, value)
+    RESPONSE_CACHE.move_to_end(key)
+    while len(RESPONSE_CACHE) > RESPONSE_CACHE_SIZE:
+        RESPONSE_CACHE.popitem(last=False)
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "service": "reels-rag-api"}
 
+# Fallback models if OpenRouter fails - Updated 2025 models
+FALLBACK_MODELS = [
+    {
+        "id": "openai/gpt-5-mini",
+        "provider": "OpenAI",
+        "label": "GPT-5 Mini",
+        "free": True,
+        "paid": False,
+        "recommended": True
+    },
+    {
+        "id": "openai/gpt-4o-mini",
+        "provider": "OpenAI", 
+        "label": "GPT-4o Mini",
+        "free": False,
+        "paid": True,
+        "recommended": True
+    },
+    {
+        "id": "anthropic/claude-3-5-sonnet",
+        "provider": "Anthropic",
+        "label": "Claude 3.5 Sonnet",
+        "free": False,
+        "paid": True,
+        "recommended": True
+    },
+    {
+        "id": "anthropic/claude-3-5-haiku",
+        "provider": "Anthropic",
+        "label": "Claude 3.5 Haiku",
+        "free": False,
+        "paid": True,
+        "recommended": False
+    },
+    {
+        "id": "google/gemini-2.0-flash",
+        "provider": "Google",
+        "label": "Gemini 2.0 Flash",
+        "free": False,
+        "paid": True,
+        "recommended": True
+    },
+    {
+        "id": "xai/grok-2",
+        "provider": "xAI",
+        "label": "Grok-2",
+        "free": False,
+        "paid": True,
+        "recommended": False
+    },
+    {
+        "id": "meta-llama/llama-3.1-405b-instruct",
+        "provider": "Meta",
+        "label": "Llama 3.1 405B Instruct", 
+        "free": False,
+        "paid": True,
+        "recommended": False
+    }
+]
+
+# Built once: served as-is whenever the OpenRouter catalog is unavailable
+FALLBACK_MODELS_PAYLOAD = {
+    "models": [m["id"] for m in FALLBACK_MODELS],
+    "items": FALLBACK_MODELS
+}
+
+@app.get("/metrics")
+async def metrics():
+    """In-flight and queued LLM work against the LLM_MAX_CONCURRENCY cap"""
+    return {
+        "llm_in_flight": LLM_METRICS["in_flight"],
+        "llm_waiting": LLM_METRICS["waiting"],
+        "llm_max_concurrency": LLM_MAX_CONCURRENCY
+    }
+
+def models_etag(payload: Dict[str, Any]) -> str:
+    """Weak validator for a /models payload (weak because GZipMiddleware may re-encode the body)"""
+    return f'W/"{hashlib.blake2b(orjson.dumps(payload), digest_size=16).hexdigest()}"'
+
+FALLBACK_MODELS_ETAG = models_etag(FALLBACK_MODELS_PAYLOAD)
+
 @app.get("/models")
-async def get_models():
+async def get_models(request: Request):
     """Get available models"""
-    # Fetch from OpenRouter first, then add fallback models
-    openrouter_models = await fetch_openrouter_models()
+    payload, etag = await cached_models()
+    # Clients revalidate with If-None-Match and get an empty 304 while the catalog is unchanged
+    headers = {"ETag": etag, "Cache-Control": "max-age=60"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in (t.strip() for t in if_none_match.split(","))):
+        return Response(status_code=304, headers=headers)
+    return ORJSONResponse(payload, headers=headers)
+
+async def cached_models() -> Tuple[Dict[str, Any], str]:
+    """The cached model catalog and its ETag, refreshing it first if it has expired"""
+    if MODELS_CACHE["data"] is not None and time.monotonic() < MODELS_CACHE["exp"]:
+        return MODELS_CACHE["data"], MODELS_CACHE["etag"]
     
-    # Fallback models if OpenRouter fails - Updated 2025 models
-    fallback_models = [
-        {
-            "id": "openai/gpt-5-mini",
-            "provider": "OpenAI",
-            "label": "GPT-5 Mini",
-            "free": True,
-            "paid": False,
-            "recommended": True
-        },
-        {
-            "id": "openai/gpt-4o-mini",
-            "provider": "OpenAI", 
-            "label": "GPT-4o Mini",
-            "free": False,
-            "paid": True,
-            "recommended": True
-        },
-        {
-            "id": "anthropic/claude-3-5-sonnet",
-            "provider": "Anthropic",
-            "label": "Claude 3.5 Sonnet",
-            "free": False,
-            "paid": True,
-            "recommended": True
-        },
-        {
-            "id": "anthropic/claude-3-5-haiku",
-            "provider": "Anthropic",
-            "label": "Claude 3.5 Haiku",
-            "free": False,
-            "paid": True,
-            "recommended": False
-        },
-        {
-            "id": "google/gemini-2.0-flash",
-            "provider": "Google",
-            "label": "Gemini 2.0 Flash",
-            "free": False,
-            "paid": True,
-            "recommended": True
-        },
-        {
-            "id": "xai/grok-2",
-            "provider": "xAI",
-            "label": "Grok-2",
-            "free": False,
-            "paid": True,
-            "recommended": False
-        },
-        {
-            "id": "meta-llama/llama-3.1-405b-instruct",
-            "provider": "Meta",
-            "label": "Llama 3.1 405B Instruct", 
-            "free": False,
-            "paid": True,
-            "recommended": False
-        }
-    ]
+    # One refresh at a time: concurrent cache misses wait for it instead of each calling OpenRouter
+    async with app.state.models_lock:
+        now = time.monotonic()
+        if MODELS_CACHE["data"] is not None and now < MODELS_CACHE["exp"]:
+            return MODELS_CACHE["data"], MODELS_CACHE["etag"]
+        
+        return await refresh_models_cache()
+
+async def refresh_models_cache() -> Tuple[Dict[str, Any], str]:
+    """Fetch the model catalog into MODELS_CACHE and return it with its ETag; callers hold
+    app.state.models_lock"""
+    now = time.monotonic()
+    # Fetch from OpenRouter first, then fall back to the built-in list
+    try:
+        openrouter_models = await fetch_openrouter_models(app.state.openrouter, app.state.http)
+    except Exception:
+        # An unexpected catalog shape must not take down /models or the background refresher
+        logger.exception("Failed to parse models from OpenRouter")
+        openrouter_models = []
     
-    models = openrouter_models if openrouter_models else fallback_models
-    model_ids = [m["id"] for m in models]
+    # A fallback is only remembered briefly, so OpenRouter is retried soon without every
+    # queued request waiting out another failed fetch
+    if not openrouter_models:
+        MODELS_CACHE.update(data=FALLBACK_MODELS_PAYLOAD, etag=FALLBACK_MODELS_ETAG, exp=now + MODELS_FALLBACK_TTL)
+        return FALLBACK_MODELS_PAYLOAD, FALLBACK_MODELS_ETAG
     
-    return {
-        "models": model_ids,
-        "items": models
+    payload = {
+        "models": [m["id"] for m in openrouter_models],
+        "items": openrouter_models
     }
+    etag = models_etag(payload)
+    MODELS_CACHE.update(data=payload, etag=etag, exp=now + MODELS_CACHE_TTL)
+    return payload, etag
+
+async def models_refresher():
+    """Keep the /models cache warm: refetch a little before each entry expires, so no request
+    ever waits on OpenRouter after startup"""
+    while True:
+        try:
+            async with app.state.models_lock:
+                await refresh_models_cache()
+        except Exception:
+            # Keep whatever is cached and retry after the fallback window instead of letting the task die
+            logger.exception("Models cache refresh failed")
+            await asyncio.sleep(MODELS_FALLBACK_TTL)
+            continue
+        await asyncio.sleep(max(MODELS_CACHE["exp"] - time.monotonic() - MODELS_REFRESH_MARGIN, 1.0))
 
 @app.post("/chat")
 async def chat_completion(request: ChatRequest):
     """Generic chat completion endpoint"""
     try:
         logger.info(f"Chat request for model: {request.model}")
-        client = get_openai_client()
         
         # Prepare messages
         messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
         
+        cache_key = response_cache_key("chat", request.model, request.temperature, messages)
+        cached = response_cache_get(cache_key)
+        if cached is not None:
+            if request.session_id:
+                save_chat_turn(request.session_id, request.step, request.messages[-1].content if request.messages else "", cached["choices"][0]["message"]["content"], request.model)
+            return cached
+        
+        client = get_openai_client()
+        
         # Make API call
         try:
             logger.info(f"Making API call with {len(messages)} messages")
-            response = client.chat.completions.create(
+            response = await run_llm(
+                client.chat.completions.create,
                 model=request.model,
                 messages=messages,
                 temperature=request.temperature,
@@ -471,10 +861,9 @@ async def chat_completion(request: ChatRequest):
         
         # Save to history if session_id provided
         if request.session_id:
-            save_chat_history(request.session_id, request.step, "user", request.messages[-1].content if request.messages else "")
-            save_chat_history(request.session_id, request.step, "assistant", response_content, request.model)
+            save_chat_turn(request.session_id, request.step, request.messages[-1].content if request.messages else "", response_content, request.model)
         
-        return {
+        result = {
             "choices": [{
                 "message": {
                     "content": response_content
@@ -482,6 +871,10 @@ async def chat_completion(request: ChatRequest):
             }],
             "usage": usage
         }
+        response_cache_put(cache_key, result)
+        return result
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Chat completion error: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
@@ -489,9 +882,6 @@ async def chat_completion(request: ChatRequest):
 @app.post("/chat/stream")
 async def chat_stream(request: ChatRequest):
     """Streaming chat completion endpoint"""
-    from fastapi.responses import StreamingResponse
-    import json
-    
     try:
         client = get_openai_client()
         
@@ -500,46 +890,44 @@ async def chat_stream(request: ChatRequest):
         
         def generate():
             try:
-                # For now, return non-streaming response in SSE format
-                response = client.chat.completions.create(
+                stream = client.chat.completions.create(
                     model=request.model,
                     messages=messages,
                     temperature=request.temperature,
-                    max_tokens=4000
+                    max_tokens=4000,
+                    stream=True,
+                    stream_options={"include_usage": True}
                 )
                 
-                content = response.choices[0].message.content or ""
-                
-                # Send content as SSE
-                yield f"event: message\ndata: {json.dumps({'delta': content})}\n\n"
+                # Forward each delta as it arrives; keep the pieces for history
+                usage_data: Dict[str, int] = {}
+                parts = []
+                for delta in iter_completion_deltas(stream, usage_data):
+                    parts.append(delta)
+                    yield sse_format(SSE_MESSAGE, {'delta': delta})
+                content = "".join(parts)
                 
                 # Send usage data
-                if response.usage:
-                    usage_data = {
-                        'prompt_tokens': response.usage.prompt_tokens,
-                        'completion_tokens': response.usage.completion_tokens
-                    }
-                    yield f"event: usage\ndata: {json.dumps(usage_data)}\n\n"
+                if usage_data:
+                    yield sse_format(SSE_USAGE, usage_data)
                 
                 # Save to history if session_id provided
                 if request.session_id and request.messages:
-                    # Save the last user message and the assistant response
-                    last_user_msg = None
-                    for msg in reversed(request.messages):
-                        if msg.role == 'user':
-                            last_user_msg = msg.content
-                            break
+                    # Save the last user message and the assistant response; the scan stops at the
+                    # first user turn from the end, which is normally the tail message itself
+                    last_user_msg = next((msg.content for msg in reversed(request.messages) if msg.role == 'user'), None)
                     
                     if last_user_msg:
-                        save_chat_history(request.session_id, request.step, "user", last_user_msg)
-                        save_chat_history(request.session_id, request.step, "assistant", content, request.model)
+                        save_chat_turn(request.session_id, request.step, last_user_msg, content, request.model)
                 
-                yield f"event: done\ndata: {json.dumps({'finish_reason': 'stop'})}\n\n"
+                yield sse_format(SSE_DONE, {'finish_reason': 'stop'})
                 
             except Exception as e:
-                yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+                yield sse_format(SSE_ERROR, {'error': str(e)})
         
-        return StreamingResponse(generate(), media_type="text/plain")
+        return StreamingResponse(
+            batch_sse_frames(limit_llm_stream(generate())), media_type="text/event-stream", headers=SSE_HEADERS
+        )
         
     except Exception as e:
         logger.error(f"Chat stream error: {e}")
@@ -548,37 +936,23 @@ async def chat_stream(request: ChatRequest):
 @app.post("/rag/chat/stream")
 async def rag_chat_stream(request: RAGRequest):
     """Streaming RAG chat endpoint"""
-    from fastapi.responses import StreamingResponse
-    import json
-    
     try:
+        # Start retrieval now so Qdrant runs while the stream waits for an LLM slot; generate()
+        # blocks on the result from its worker thread
+        context_future = (
+            app.state.retrieval_pool.submit(retrieve_context, request.query, top_k=request.top_k or 8, client=app.state.llm)
+            if PIPELINE_AVAILABLE else None
+        )
+
         def generate():
             try:
-                # Import pipeline functions
-                try:
-                    from scripts.run_pipeline import retrieve_context, chat_complete
-                    
+                if context_future is not None:
                     # Get context
-                    context = retrieve_context(request.query, top_k=request.top_k or 8)
+                    context = context_future.result()
                     
                     # Load step-specific prompt
                     step = request.step or 'ideation'
-                    prompt_file_map = {
-                        'ideation': '01_ideation_and_edl.md',
-                        'outline': '01a_ideation_outline.md', 
-                        'edl': '01b_edl_from_outline.md',
-                        'script': '02_script_vipinclaude.md',
-                        'suno': '03_suno_prompt.md',
-                        'handoff': '04_editor_handoff.md'
-                    }
-                    
-                    prompt_file = prompt_file_map.get(step, '01_ideation_and_edl.md')
-                    try:
-                        with open(f"prompts/{prompt_file}", 'r', encoding='utf-8') as f:
-                            step_prompt = f.read()
-                    except Exception as e:
-                        logger.warning(f"Could not load prompt file {prompt_file}: {e}")
-                        step_prompt = "You are a helpful assistant for travel content creation."
+                    step_prompt = load_prompt(STEP_PROMPT_FILES.get(step, '01_ideation_and_edl.md'))
                     
                     # Combine step prompt with context
                     system_prompt = f"{step_prompt}\n\nRELEVANT CONTEXT FROM YOUR DOCUMENTS:\n{context}"
@@ -611,39 +985,30 @@ async def rag_chat_stream(request: RAGRequest):
                     
                     # Generate response using OpenAI client directly for conversation support
                     client = get_openai_client()
-                    response = client.chat.completions.create(
+                    stream = client.chat.completions.create(
                         model=request.model,
                         messages=final_messages,
                         temperature=request.temperature or 0.7,
-                        max_tokens=4000
+                        max_tokens=4000,
+                        stream=True
                     )
                     
-                    response_content = response.choices[0].message.content or ""
-                    
-                    # Estimate output tokens
-                    estimated_output_tokens = len(response_content) // 4
-                    
                     # Extract citations
-                    citations = []
-                    if context:
-                        sources = []
-                        for line in context.split('\n'):
-                            if line.startswith('SOURCE:'):
-                                source_name = line.replace('SOURCE:', '').strip()
-                                if source_name not in sources:
-                                    sources.append(source_name)
-                                    citations.append({
-                                        "source": source_name,
-                                        "title": source_name.split('/')[-1],
-                                        "excerpt": ""
-                                    })
+                    citations = extract_citations(context)
                     
                     # Send citations first
                     if citations:
-                        yield f"event: context\ndata: {json.dumps({'citations': citations})}\n\n"
+                        yield sse_format(SSE_CONTEXT, {'citations': citations})
+                    
+                    # Send content as it is generated
+                    parts = []
+                    for delta in iter_completion_deltas(stream, {}):
+                        parts.append(delta)
+                        yield sse_format(SSE_MESSAGE, {'delta': delta})
+                    response_content = "".join(parts)
                     
-                    # Send content
-                    yield f"event: message\ndata: {json.dumps({'delta': response_content})}\n\n"
+                    # Estimate output tokens
+                    estimated_output_tokens = len(response_content) // 4
                     
                     # Send usage data including RAG context tokens
                     usage_data = {
@@ -652,50 +1017,52 @@ async def rag_chat_stream(request: RAGRequest):
                         'context_tokens': context_tokens,  # Additional info about RAG context
                         'rag_enabled': True
                     }
-                    yield f"event: usage\ndata: {json.dumps(usage_data)}\n\n"
+                    yield sse_format(SSE_USAGE, usage_data)
                     
                     # Save to history if session_id provided
                     if request.session_id:
-                        save_chat_history(request.session_id, request.step, "user", request.query)
-                        save_chat_history(request.session_id, request.step, "assistant", response_content, request.model)
+                        save_chat_turn(request.session_id, request.step, request.query, response_content, request.model)
                     
-                    yield f"event: done\ndata: {json.dumps({'finish_reason': 'stop'})}\n\n"
+                    yield sse_format(SSE_DONE, {'finish_reason': 'stop'})
                     
-                except ImportError:
+                else:
                     # Fallback without RAG
                     client = get_openai_client()
-                    response = client.chat.completions.create(
+                    stream = client.chat.completions.create(
                         model=request.model,
                         messages=[
                             {"role": "system", "content": "You are a helpful assistant for travel content creation."},
                             {"role": "user", "content": request.query}
                         ],
                         temperature=request.temperature,
-                        max_tokens=4000
+                        max_tokens=4000,
+                        stream=True,
+                        stream_options={"include_usage": True}
                     )
                     
-                    content = response.choices[0].message.content or ""
-                    yield f"event: message\ndata: {json.dumps({'delta': content})}\n\n"
+                    usage_data: Dict[str, int] = {}
+                    parts = []
+                    for delta in iter_completion_deltas(stream, usage_data):
+                        parts.append(delta)
+                        yield sse_format(SSE_MESSAGE, {'delta': delta})
+                    content = "".join(parts)
                     
                     # Send usage data for fallback
-                    if response.usage:
-                        usage_data = {
-                            'prompt_tokens': response.usage.prompt_tokens,
-                            'completion_tokens': response.usage.completion_tokens
-                        }
-                        yield f"event: usage\ndata: {json.dumps(usage_data)}\n\n"
+                    if usage_data:
+                        yield sse_format(SSE_USAGE, usage_data)
                     
                     # Save to history if session_id provided (fallback path)
                     if request.session_id:
-                        save_chat_history(request.session_id, request.step, "user", request.query)
-                        save_chat_history(request.session_id, request.step, "assistant", content, request.model)
+                        save_chat_turn(request.session_id, request.step, request.query, content, request.model)
                     
-                    yield f"event: done\ndata: {json.dumps({'finish_reason': 'stop'})}\n\n"
+                    yield sse_format(SSE_DONE, {'finish_reason': 'stop'})
                     
             except Exception as e:
-                yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+                yield sse_format(SSE_ERROR, {'error': str(e)})
         
-        return StreamingResponse(generate(), media_type="text/plain")
+        return StreamingResponse(
+            batch_sse_frames(limit_llm_stream(generate())), media_type="text/event-stream", headers=SSE_HEADERS
+        )
         
     except Exception as e:
         logger.error(f"RAG stream error: {e}")
@@ -706,15 +1073,12 @@ async def rag_chat(request: RAGRequest):
     """RAG-enabled chat endpoint"""
     try:
         logger.info(f"RAG request for model: {request.model}, query: {request.query[:100]}...")
-        # Import pipeline functions
-        try:
-            from scripts.run_pipeline import retrieve_context, get_openai_client as pipeline_client, chat_complete
-        except ImportError:
-            logger.warning("Pipeline not available, using fallback")
+        if not PIPELINE_AVAILABLE:
             # Fallback if pipeline not available
             client = get_openai_client()
             try:
-                response = client.chat.completions.create(
+                response = await run_llm(
+                    client.chat.completions.create,
                     model=request.model,
                     messages=[
                         {"role": "system", "content": "You are a helpful assistant for travel content creation."},
@@ -735,8 +1099,7 @@ async def rag_chat(request: RAGRequest):
             
             # Save to history if session_id provided
             if request.session_id:
-                save_chat_history(request.session_id, request.step, "user", request.query)
-                save_chat_history(request.session_id, request.step, "assistant", response_content, request.model)
+                save_chat_turn(request.session_id, request.step, request.query, response_content, request.model)
             
             return {
                 "choices": [{
@@ -748,38 +1111,36 @@ async def rag_chat(request: RAGRequest):
                 "usage": usage
             }
         
-        # Use RAG pipeline
-        context = retrieve_context(request.query, top_k=request.top_k or 8)
+        cache_key = response_cache_key("rag", request.model, request.temperature, request.top_k, request.query)
+        cached = response_cache_get(cache_key)
+        if cached is not None:
+            if request.session_id:
+                save_chat_turn(request.session_id, request.step, request.query, cached["choices"][0]["message"]["content"], request.model)
+            return cached
+        
+        # Use RAG pipeline. Qdrant search + embedding are blocking, so retrieval and citation
+        # extraction run together in the threadpool instead of on the event loop.
+        def retrieve_with_citations():
+            ctx = retrieve_context(request.query, top_k=request.top_k or 8, client=app.state.llm)
+            return ctx, extract_citations(ctx)
+
+        context, citations = await run_in_threadpool(retrieve_with_citations)
         system_prompt = f"You are a helpful assistant for travel content creation. Use the following context to answer questions:\n\n{context}"
         
-        response_content = chat_complete(
+        response_content = await run_llm(
+            chat_complete,
             system=system_prompt,
             user=request.query,
             model=request.model,
-            temperature=request.temperature or 0.7
+            temperature=request.temperature or 0.7,
+            client=app.state.llm
         )
         
-        # Extract citations from context
-        citations = []
-        if context:
-            sources = []
-            for line in context.split('\n'):
-                if line.startswith('SOURCE:'):
-                    source_name = line.replace('SOURCE:', '').strip()
-                    if source_name not in sources:
-                        sources.append(source_name)
-                        citations.append({
-                            "source": source_name,
-                            "title": source_name.split('/')[-1],
-                            "excerpt": ""
-                        })
-        
         # Save to history if session_id provided
         if request.session_id:
-            save_chat_history(request.session_id, request.step, "user", request.query)
-            save_chat_history(request.session_id, request.step, "assistant", response_content, request.model)
+            save_chat_turn(request.session_id, request.step, request.query, response_content, request.model)
         
-        return {
+        result = {
             "choices": [{
                 "message": {
                     "content": response_content
@@ -791,10 +1152,25 @@ async def rag_chat(request: RAGRequest):
                 "completion_tokens": 100  # Estimate
             }
         }
+        response_cache_put(cache_key, result)
+        return result
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"RAG chat error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+HISTORY_COLUMNS = ("role", "content", "model", "ts", "step")
+# Constant SQL text so sqlite3's per-connection statement cache reuses the prepared statements
+HISTORY_SQL = f"SELECT {', '.join(HISTORY_COLUMNS)} FROM chat_history WHERE session_id = ? ORDER BY ts DESC LIMIT ?"
+HISTORY_SQL_STEP = (
+    f"SELECT {', '.join(HISTORY_COLUMNS)} FROM chat_history WHERE session_id = ? AND step = ? ORDER BY ts DESC LIMIT ?"
+)
+
+def history_row(cursor: sqlite3.Cursor, row: tuple) -> Dict[str, Any]:
+    """Row factory for /history: rows come out of fetchall() as response-ready message dicts"""
+    return dict(zip(HISTORY_COLUMNS, row))
+
 @app.get("/history")
 async def get_history(
     session_id: str = Query(..., description="Session ID"),
@@ -802,229 +1178,342 @@ async def get_history(
     limit: int = Query(200, description="Maximum number of messages")
 ):
     """Get chat history for a session"""
+    def fetch_rows():
+        with DB_LOCK:
+            cursor = DB.cursor()
+            cursor.row_factory = history_row
+            if step:
+                cursor.execute(HISTORY_SQL_STEP, (session_id, step, limit))
+            else:
+                cursor.execute(HISTORY_SQL, (session_id, limit))
+            return cursor.fetchall()
+
     try:
-        conn = sqlite3.connect(SQLITE_PATH)
-        cursor = conn.cursor()
-        
-        if step:
-            cursor.execute("""
-                SELECT role, content, model, ts, step 
-                FROM chat_history 
-                WHERE session_id = ? AND step = ?
-                ORDER BY ts DESC 
-                LIMIT ?
-            """, (session_id, step, limit))
-        else:
-            cursor.execute("""
-                SELECT role, content, model, ts, step 
-                FROM chat_history 
-                WHERE session_id = ?
-                ORDER BY ts DESC 
-                LIMIT ?
-            """, (session_id, limit))
-        
-        rows = cursor.fetchall()
-        conn.close()
-        
-        messages = []
-        for row in rows:
-            messages.append({
-                "role": row[0],
-                "content": row[1],
-                "model": row[2],
-                "ts": row[3],
-                "step": row[4]
-            })
+        messages = await run_in_threadpool(fetch_rows)
         
-        return {
+        return ORJSONResponse({
             "session_id": session_id,
             "step": step,
             "messages": messages
-        }
-    except Exception as e:
+        })
+    except sqlite3.Error as e:
         logger.error(f"History fetch error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # Pipeline endpoints
+# Stages are synchronous and make blocking LLM/Qdrant calls; they and the artifact reads run in the
+# threadpool so a long pipeline run doesn't freeze the event loop for every other request
+# Each run writes into its own directory under PIPELINE_RUNS_DIR and the handler reads the artifact
+# back from there, so concurrent runs (threads or gunicorn workers) never see each other's output.
+# The stage also publishes its artifact to out/ as the latest output. Run directories are pruned
+# once they are older than PIPELINE_RUN_TTL
+PIPELINE_RUNS_DIR = Path("out") / "requests"
+PIPELINE_RUN_TTL = 3600.0
+# Identical concurrent stage runs share one task and run directory: a duplicate (double click,
+# client retry) would only pay for the same generation twice
+PIPELINE_INFLIGHT: Dict[str, "asyncio.Task[Path]"] = {}
+
+def prune_pipeline_runs():
+    """Remove run directories older than PIPELINE_RUN_TTL"""
+    cutoff = time.time() - PIPELINE_RUN_TTL
+    try:
+        entries = list(os.scandir(PIPELINE_RUNS_DIR))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except OSError:
+            continue
+
+def call_stage(stage, args: "PipelineArgs") -> Path:
+    """Run a stage in a fresh run directory and return it.
+
+    Stages report CLI usage errors (e.g. no outline yet) with SystemExit; re-raise those as an
+    ordinary exception so they reach the endpoint's error handling instead of stopping the loop.
+    """
+    prune_pipeline_runs()
+    PIPELINE_RUNS_DIR.mkdir(parents=True, exist_ok=True)
+    run_dir = Path(tempfile.mkdtemp(prefix=f"{stage.__name__}-", dir=PIPELINE_RUNS_DIR))
+    try:
+        stage(replace(args, out_dir=str(run_dir)))
+    except SystemExit as e:
+        raise RuntimeError(str(e)) from None
+    return run_dir
+
+async def run_stage(stage, args: "PipelineArgs") -> Path:
+    """run_llm for a pipeline stage, coalescing requests with identical arguments onto one run;
+    returns the run directory holding the stage's artifact"""
+    key = response_cache_key(stage.__name__, astuple(args))
+    task = PIPELINE_INFLIGHT.get(key)
+    if task is None:
+        task = asyncio.ensure_future(run_llm(call_stage, stage, args))
+        PIPELINE_INFLIGHT[key] = task
+        task.add_done_callback(lambda _: PIPELINE_INFLIGHT.pop(key, None))
+    # Shielded so one caller disconnecting doesn't cancel the run the others are waiting on
+    return await asyncio.shield(task)
+
+def read_pipeline_output(path: Path) -> str:
+    """Read a stage artifact, or a placeholder if the stage produced nothing"""
+    # One open() instead of exists() + open(), and no window for the file to vanish in between
+    try:
+        return Path(path).read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return "No output generated"
+
+def stream_pipeline_output(path: Path):
+    """Send a stage artifact as a chunked file body instead of embedding it in JSON (?stream=1)"""
+    output_file = Path(path)
+    # One stat() handed to FileResponse, which would otherwise stat the file again itself
+    try:
+        stat_result = output_file.stat()
+    except FileNotFoundError:
+        return PlainTextResponse("No output generated")
+    media_type = "text/markdown; charset=utf-8" if output_file.suffix == ".md" else "text/plain; charset=utf-8"
+    return FileResponse(output_file, stat_result=stat_result, media_type=media_type, filename=output_file.name, content_disposition_type="inline")
+
 @app.post("/pipeline/ideation")
-async def pipeline_ideation(request: PipelineRequest):
+async def pipeline_ideation(request: PipelineRequest, stream: bool = Query(False, description="Stream the artifact instead of returning JSON")):
     """Pipeline ideation endpoint"""
     try:
-        from scripts.run_pipeline import stage_ideation
-        import argparse
-        
-        # Create args object
-        args = argparse.Namespace()
-        args.topic = request.topic or "Vietnam travel reels"
-        args.trip = request.trip
-        args.persona = request.persona
-        args.top_k = request.top_k or 8
-        args.model = request.model or "openai/gpt-5-mini"
-        args.temperature = request.temperature or 0.4
-        args.session_id = request.session_id
+        if not PIPELINE_AVAILABLE:
+            raise RuntimeError("Pipeline module not available")
+
+        args = PipelineArgs(**request.model_dump(exclude={"step"}))
+        args.topic = args.topic or "Vietnam travel reels"
         
         # Run ideation
-        stage_ideation(args)
+        run_dir = await run_stage(stage_ideation, args)
         
+        if stream:
+            return stream_pipeline_output(run_dir / "01_ideation_and_edl.md")
+
         # Read output
-        from pathlib import Path
-        output_file = Path("out/01_ideation_and_edl.md")
-        content = output_file.read_text(encoding="utf-8") if output_file.exists() else "No output generated"
+        content = await run_in_threadpool(read_pipeline_output, run_dir / "01_ideation_and_edl.md")
         
-        return {
+        return ORJSONResponse({
             "status": "success",
             "content": content,
             "file": "01_ideation_and_edl.md",
             "out_dir": "out"
-        }
+        })
     except Exception as e:
         logger.error(f"Pipeline ideation error: {e}")
-        return {"status": "error", "content": f"Error: {str(e)}", "file": None}
+        return ORJSONResponse({"status": "error", "content": f"Error: {str(e)}", "file": None})
 
 @app.post("/pipeline/outline") 
-async def pipeline_outline(request: PipelineRequest):
+async def pipeline_outline(request: PipelineRequest, stream: bool = Query(False, description="Stream the artifact instead of returning JSON")):
     """Pipeline outline endpoint"""
     try:
-        from scripts.run_pipeline import stage_outline
-        import argparse
-        
-        args = argparse.Namespace()
-        args.topic = request.topic or "Travel reel outline"
-        args.trip = request.trip
-        args.persona = request.persona
-        args.top_k = request.top_k or 8
-        args.model = request.model or "openai/gpt-5-mini"
-        args.temperature = request.temperature or 0.4
-        args.session_id = request.session_id
-        args.prompt = request.prompt
+        if not PIPELINE_AVAILABLE:
+            raise RuntimeError("Pipeline module not available")
+
+        args = PipelineArgs(**request.model_dump(exclude={"step"}))
+        args.topic = args.topic or "Travel reel outline"
         
-        stage_outline(args)
+        run_dir = await run_stage(stage_outline, args)
         
-        from pathlib import Path
-        output_file = Path("out/01a_ideation_outline.md")
-        content = output_file.read_text(encoding="utf-8") if output_file.exists() else "No output generated"
+        if stream:
+            return stream_pipeline_output(run_dir / "01a_ideation_outline.md")
+
+        content = await run_in_threadpool(read_pipeline_output, run_dir / "01a_ideation_outline.md")
         
-        return {
+        return ORJSONResponse({
             "status": "success",
             "content": content,
             "file": "01a_ideation_outline.md"
-        }
+        })
     except Exception as e:
         logger.error(f"Pipeline outline error: {e}")
-        return {"status": "error", "content": f"Error: {str(e)}", "file": None}
+        return ORJSONResponse({"status": "error", "content": f"Error: {str(e)}", "file": None})
 
 @app.post("/pipeline/edl")
-async def pipeline_edl(request: PipelineRequest):
+async def pipeline_edl(request: PipelineRequest, stream: bool = Query(False, description="Stream the artifact instead of returning JSON")):
     """Pipeline EDL endpoint"""
     try:
-        from scripts.run_pipeline import stage_edl_from_outline
-        import argparse
-        
-        args = argparse.Namespace()
-        args.topic = request.topic
-        args.trip = request.trip
-        args.persona = request.persona
-        args.outline = request.outline
-        args.top_k = request.top_k or 8
-        args.model = request.model or "openai/gpt-5-mini"
-        args.temperature = request.temperature or 0.4
-        args.session_id = request.session_id
+        if not PIPELINE_AVAILABLE:
+            raise RuntimeError("Pipeline module not available")
+
+        args = PipelineArgs(**request.model_dump(exclude={"step"}))
         
-        stage_edl_from_outline(args)
+        run_dir = await run_stage(stage_edl_from_outline, args)
         
-        from pathlib import Path
-        output_file = Path("out/01b_edl_from_outline.md")
-        content = output_file.read_text(encoding="utf-8") if output_file.exists() else "No output generated"
+        if stream:
+            return stream_pipeline_output(run_dir / "01b_edl_from_outline.md")
+
+        content = await run_in_threadpool(read_pipeline_output, run_dir / "01b_edl_from_outline.md")
         
-        return {
+        return ORJSONResponse({
             "status": "success",
             "content": content,
             "file": "01b_edl_from_outline.md"
-        }
+        })
     except Exception as e:
         logger.error(f"Pipeline EDL error: {e}")
-        return {"status": "error", "content": f"Error: {str(e)}", "file": None}
+        return ORJSONResponse({"status": "error", "content": f"Error: {str(e)}", "file": None})
 
 @app.post("/pipeline/script")
-async def pipeline_script(request: PipelineRequest):
+async def pipeline_script(request: PipelineRequest, stream: bool = Query(False, description="Stream the artifact instead of returning JSON")):
     """Pipeline script endpoint"""
     try:
-        from scripts.run_pipeline import stage_script
-        import argparse
-        
-        args = argparse.Namespace()
-        args.topic = request.topic
-        args.trip = request.trip
-        args.persona = request.persona
-        args.outline = request.outline
-        args.edl = request.edl
-        args.script = request.script
-        args.top_k = request.top_k or 8
-        args.model = request.model or "openai/gpt-5-mini"
-        args.temperature = request.temperature or 0.4
-        args.session_id = request.session_id
+        if not PIPELINE_AVAILABLE:
+            raise RuntimeError("Pipeline module not available")
+
+        args = PipelineArgs(**request.model_dump(exclude={"step"}))
         
-        stage_script(args)
+        run_dir = await run_stage(stage_script, args)
         
-        from pathlib import Path
-        output_file = Path("out/02_script_vipinclaude.md")
-        content = output_file.read_text(encoding="utf-8") if output_file.exists() else "No output generated"
+        if stream:
+            return stream_pipeline_output(run_dir / "02_script_vipinclaude.md")
+
+        content = await run_in_threadpool(read_pipeline_output, run_dir / "02_script_vipinclaude.md")
         
-        return {
+        return ORJSONResponse({
             "status": "success",
             "content": content,
             "file": "02_script_vipinclaude.md"
-        }
+        })
     except Exception as e:
         logger.error(f"Pipeline script error: {e}")
-        return {"status": "error", "content": f"Error: {str(e)}", "file": None}
+        return ORJSONResponse({"status": "error", "content": f"Error: {str(e)}", "file": None})
 
 @app.post("/pipeline/suno")
-async def pipeline_suno(request: PipelineRequest):
+async def pipeline_suno(request: PipelineRequest, stream: bool = Query(False, description="Stream the artifact instead of returning JSON")):
     """Pipeline suno endpoint"""
     try:
-        from scripts.run_pipeline import stage_suno
-        import argparse
-        
-        args = argparse.Namespace()
-        args.script = request.script
-        args.suno = request.suno
-        args.model = request.model or "openai/gpt-5-mini"
-        args.temperature = request.temperature or 0.4
-        args.session_id = request.session_id
+        if not PIPELINE_AVAILABLE:
+            raise RuntimeError("Pipeline module not available")
+
+        args = PipelineArgs(**request.model_dump(exclude={"step"}))
         
-        stage_suno(args)
+        run_dir = await run_stage(stage_suno, args)
         
-        from pathlib import Path
-        output_file = Path("out/03_suno_prompt.txt")
-        content = output_file.read_text(encoding="utf-8") if output_file.exists() else "No output generated"
+        if stream:
+            return stream_pipeline_output(run_dir / "03_suno_prompt.txt")
+
+        content = await run_in_threadpool(read_pipeline_output, run_dir / "03_suno_prompt.txt")
         
-        return {
+        return ORJSONResponse({
             "status": "success",
             "content": content,
             "file": "03_suno_prompt.txt"
-        }
+        })
     except Exception as e:
         logger.error(f"Pipeline suno error: {e}")
-        return {"status": "error", "content": f"Error: {str(e)}", "file": None}
+        return ORJSONResponse({"status": "error", "content": f"Error: {str(e)}", "file": None})
+
+@app.post("/pipeline/run")
+async def pipeline_run(request: PipelineRequest):
+    """Run outline -> EDL -> script -> suno in one request, streaming a stage event as each one
+    starts and finishes, then every artifact in the final done event.
+
+    The chain starts at outline and leaves out /pipeline/ideation: the outline stage generates
+    its own idea from the topic, while ideation is the standalone one-shot ideas + EDL path whose
+    artifact no later stage reads.
+    """
+    if not PIPELINE_AVAILABLE:
+        return ORJSONResponse({"status": "error", "content": "Error: Pipeline module not available", "file": None})
+
+    args = PipelineArgs(**request.model_dump(exclude={"step"}))
+    args.topic = args.topic or "Travel reel outline"
+    # (stage name, stage, artifact, PipelineArgs field that hands the artifact to later stages).
+    # Artifacts are handed on from each stage's own run directory, never the shared out/ copies,
+    # so a concurrent run (in this or another worker) can't swap its output into this chain
+    stages = (
+        ("outline", stage_outline, "01a_ideation_outline.md", "outline"),
+        ("edl", stage_edl_from_outline, "01b_edl_from_outline.md", "edl"),
+        ("script", stage_script, "02_script_vipinclaude.md", "script"),
+        ("suno", stage_suno, "03_suno_prompt.txt", None),
+    )
+
+    async def generate():
+        files = {}
+        for name, stage, file_name, feeds in stages:
+            yield sse_format(SSE_STAGE, {"stage": name, "status": "started"})
+            try:
+                run_dir = await run_stage(stage, args)
+            except Exception as e:
+                logger.error(f"Pipeline run {name} error: {e}")
+                yield sse_format(SSE_ERROR, {"stage": name, "error": str(e)})
+                return
+            files[file_name] = await run_in_threadpool(read_pipeline_output, run_dir / file_name)
+            if feeds:
+                setattr(args, feeds, str(run_dir / file_name))
+            yield sse_format(SSE_STAGE, {"stage": name, "status": "done", "file": file_name})
+        yield sse_format(SSE_DONE, {"files": files})
+
+    return StreamingResponse(generate(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+# History writes are queued and drained by one writer thread, so request handlers never wait on
+# an INSERT + commit; rows arriving within a short window are written with one executemany/commit
+# Each queue item is a list of rows that must land in the same transaction; None stops the writer
+HISTORY_QUEUE: "queue.Queue[Optional[List[tuple]]]" = queue.Queue()
+HISTORY_BATCH_SIZE = 64
+HISTORY_BATCH_WINDOW = 0.05
+HISTORY_INSERT_SQL = "INSERT INTO chat_history (session_id, step, role, content, model, ts) VALUES (?, ?, ?, ?, ?, ?)"
+# After this long without writes the writer truncates the WAL, off the event loop
+WAL_CHECKPOINT_INTERVAL = 300.0
+
+def history_writer():
+    """Drain HISTORY_QUEUE until a None sentinel, inserting each window's rows in one transaction
+    and checkpointing the WAL whenever the queue has been idle for WAL_CHECKPOINT_INTERVAL"""
+    stopping = False
+    while not stopping:
+        try:
+            first = HISTORY_QUEUE.get(timeout=WAL_CHECKPOINT_INTERVAL)
+        except queue.Empty:
+            try:
+                with DB_LOCK:
+                    DB.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except sqlite3.Error as e:
+                logger.warning(f"WAL checkpoint failed: {e}")
+            continue
+        if first is None:
+            break
+        batch = list(first)
+        deadline = time.monotonic() + HISTORY_BATCH_WINDOW
+        while len(batch) < HISTORY_BATCH_SIZE:
+            try:
+                item = HISTORY_QUEUE.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is None:
+                stopping = True
+                break
+            batch.extend(item)
+        try:
+            with DB_LOCK:
+                DB.executemany(HISTORY_INSERT_SQL, batch)
+                DB.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to save chat history ({len(batch)} messages): {e}")
 
 def save_chat_history(session_id: str, step: Optional[str], role: str, content: str, model: Optional[str] = None):
-    """Save chat message to history"""
-    try:
-        conn = sqlite3.connect(SQLITE_PATH)
-        cursor = conn.cursor()
-        ts = int(datetime.now(timezone.utc).timestamp() * 1000)
-        
-        cursor.execute("""
-            INSERT INTO chat_history (session_id, step, role, content, model, ts)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (session_id, step, role, content, model, ts))
-        
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        logger.error(f"Failed to save chat history: {e}")
+    """Queue a chat message for the history writer"""
+    ts = time.time_ns() // 1_000_000
+    HISTORY_QUEUE.put_nowait([(session_id, step, role, content, model, ts)])
+
+def save_chat_turn(session_id: str, step: Optional[str], user_content: str, assistant_content: str, model: Optional[str] = None):
+    """Queue a user message and its reply as one item, so they are committed in the same transaction"""
+    ts = time.time_ns() // 1_000_000
+    HISTORY_QUEUE.put_nowait([
+        (session_id, step, "user", user_content, None, ts),
+        (session_id, step, "assistant", assistant_content, model, ts)
+    ])
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # uvloop/httptools are picked up automatically when installed (uvicorn[standard]).
+    # Caches, the history writer and the SQLite connection are per process, so extra
+    # WEB_CONCURRENCY workers each keep their own copies.
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    # Multiple workers need an import string, which only resolves when started from the repo
+    # root as `python -m server.app`; a single worker takes the app object, so
+    # `python server/app.py` keeps working too
+    uvicorn.run(
+        "server.app:app" if workers > 1 else app,
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "8000")),
+        workers=workers,
+    )
\ No newline at end of file
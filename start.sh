@@ -1,3 +1,3 @@
 #!/bin/bash
 export PORT=${PORT:-8000}
-exec python -m uvicorn server.app:app --host 0.0.0.0 --port $PORT
\ No newline at end of file
+exec python -m gunicorn -c gunicorn_conf.py server.app:app
\ No newline at end of file
@@ -2,138 +2,147 @@
 """
 Test the complete Vietnam Reels RAG workflow end-to-end
 """
-import requests
-import json
-import time
+import asyncio
+
+import httpx
+import orjson
 
 BASE_URL = "http://localhost:3001"
+SSE_DATA_PREFIX = b"data: "
 
-def test_workflow():
-    print("🧪 Testing Vietnam Reels RAG Workflow End-to-End")
-    print("=" * 60)
-    
-    # Test 1: Models endpoint
+async def sse_data(response: httpx.Response):
+    """Yield the decoded JSON of each SSE data line, working on raw bytes so ignored lines
+    (event names, blanks) are never decoded"""
+    buffer = b""
+    async for chunk in response.aiter_bytes():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.startswith(SSE_DATA_PREFIX):
+                try:
+                    yield orjson.loads(line[len(SSE_DATA_PREFIX):].rstrip(b"\r"))
+                except orjson.JSONDecodeError:
+                    continue
+
+async def check_models(client: httpx.AsyncClient) -> bool:
     print("\n1. Testing Models Endpoint...")
-    response = requests.get(f"{BASE_URL}/api/models")
+    response = await client.get("/api/models")
     if response.status_code == 200:
         models = response.json()
         print(f"   ✅ Found {len(models)} models available")
-    else:
-        print(f"   ❌ Models endpoint failed: {response.status_code}")
-        return
-    
-    # Test 2: RAG Chat Stream - Ideation
-    print("\n2. Testing RAG Chat Stream - Ideation Step...")
+        return True
+    print(f"   ❌ Models endpoint failed: {response.status_code}")
+    return False
+
+async def check_rag_stream(client: httpx.AsyncClient) -> list:
+    """RAG ideation stream; returns its report lines so concurrent tests don't interleave output"""
+    report = ["\n2. Testing RAG Chat Stream - Ideation Step..."]
     payload = {
         "query": "Create 3 viral Vietnam travel reel ideas using our actual Phu Quoc and Ninh Binh footage",
         "model": "openai/gpt-4o-mini",
         "session_id": "workflow_test",
         "step": "ideation"
     }
-    
-    response = requests.post(f"{BASE_URL}/api/rag/chat/stream", 
-                           json=payload, 
-                           stream=True)
-    
-    if response.status_code == 200:
+
+    async with client.stream("POST", "/api/rag/chat/stream", json=payload) as response:
+        if response.status_code != 200:
+            report.append(f"   ❌ RAG Chat Stream failed: {response.status_code}")
+            return report
+
         citations_found = False
         tokens_found = False
         content_chunks = []
-        
-        for line in response.iter_lines():
-            if line:
-                line_str = line.decode('utf-8')
-                if line_str.startswith('data: '):
-                    try:
-                        data = json.loads(line_str[6:])
-                        
-                        # Check for citations
-                        if 'citations' in data:
-                            citations_found = True
-                            print(f"   ✅ Citations found: {len(data['citations'])} sources")
-                            
-                        # Check for content
-                        if 'delta' in data:
-                            content_chunks.append(data['delta'])
-                            
-                        # Check for usage tokens
-                        if 'context_tokens' in data:
-                            tokens_found = True
-                            print(f"   ✅ Context tokens: {data['context_tokens']}")
-                            print(f"   ✅ RAG enabled: {data.get('rag_enabled', False)}")
-                            
-                    except json.JSONDecodeError:
-                        continue
-                        
-        full_content = ''.join(content_chunks)
-        
-        if citations_found and tokens_found and len(full_content) > 100:
-            print("   ✅ RAG Ideation Step - WORKING")
-            print(f"   📝 Generated {len(full_content)} characters of content")
-        else:
-            print("   ❌ RAG Ideation Step - Missing components")
-            
+
+        async for data in sse_data(response):
+            # Check for citations
+            if 'citations' in data:
+                citations_found = True
+                report.append(f"   ✅ Citations found: {len(data['citations'])} sources")
+
+            # Check for content
+            if 'delta' in data:
+                content_chunks.append(data['delta'])
+
+            # Check for usage tokens
+            if 'context_tokens' in data:
+                tokens_found = True
+                report.append(f"   ✅ Context tokens: {data['context_tokens']}")
+                report.append(f"   ✅ RAG enabled: {data.get('rag_enabled', False)}")
+
+    full_content = ''.join(content_chunks)
+
+    if citations_found and tokens_found and len(full_content) > 100:
+        report.append("   ✅ RAG Ideation Step - WORKING")
+        report.append(f"   📝 Generated {len(full_content)} characters of content")
     else:
-        print(f"   ❌ RAG Chat Stream failed: {response.status_code}")
-        return
-    
-    # Test 3: Non-RAG Chat Stream
-    print("\n3. Testing Non-RAG Chat Stream...")
+        report.append("   ❌ RAG Ideation Step - Missing components")
+    return report
+
+async def check_chat_stream(client: httpx.AsyncClient) -> list:
+    """Non-RAG chat stream; returns its report lines"""
+    report = ["\n3. Testing Non-RAG Chat Stream..."]
     payload = {
         "query": "What is the capital of France?",
         "model": "openai/gpt-4o-mini",
         "session_id": "workflow_test"
     }
-    
-    response = requests.post(f"{BASE_URL}/api/chat/stream", 
-                           json=payload, 
-                           stream=True)
-    
-    if response.status_code == 200:
+
+    async with client.stream("POST", "/api/chat/stream", json=payload) as response:
+        if response.status_code != 200:
+            report.append(f"   ❌ Non-RAG Chat Stream failed: {response.status_code}")
+            return report
+
         tokens_found = False
         content_chunks = []
-        
-        for line in response.iter_lines():
-            if line:
-                line_str = line.decode('utf-8')
-                if line_str.startswith('data: '):
-                    try:
-                        data = json.loads(line_str[6:])
-                        
-                        # Check for content
-                        if 'delta' in data:
-                            content_chunks.append(data['delta'])
-                            
-                        # Check for usage tokens
-                        if 'completion_tokens' in data:
-                            tokens_found = True
-                            print(f"   ✅ Completion tokens: {data['completion_tokens']}")
-                            print(f"   ✅ RAG enabled: {data.get('rag_enabled', False)}")
-                            
-                    except json.JSONDecodeError:
-                        continue
-                        
-        full_content = ''.join(content_chunks)
-        
-        if tokens_found and len(full_content) > 10:
-            print("   ✅ Non-RAG Chat Stream - WORKING")
-        else:
-            print("   ❌ Non-RAG Chat Stream - Missing components")
-            
+
+        async for data in sse_data(response):
+            # Check for content
+            if 'delta' in data:
+                content_chunks.append(data['delta'])
+
+            # Check for usage tokens
+            if 'completion_tokens' in data:
+                tokens_found = True
+                report.append(f"   ✅ Completion tokens: {data['completion_tokens']}")
+                report.append(f"   ✅ RAG enabled: {data.get('rag_enabled', False)}")
+
+    full_content = ''.join(content_chunks)
+
+    if tokens_found and len(full_content) > 10:
+        report.append("   ✅ Non-RAG Chat Stream - WORKING")
     else:
-        print(f"   ❌ Non-RAG Chat Stream failed: {response.status_code}")
-        
-    # Test 4: Chat History
+        report.append("   ❌ Non-RAG Chat Stream - Missing components")
+    return report
+
+async def check_history(client: httpx.AsyncClient) -> None:
     print("\n4. Testing Chat History...")
-    response = requests.get(f"{BASE_URL}/api/history/workflow_test")
+    response = await client.get("/api/history/workflow_test")
     if response.status_code == 200:
         history = response.json()
         print(f"   ✅ Chat history retrieved: {len(history)} messages")
     else:
         print(f"   ❌ Chat history failed: {response.status_code}")
-    
+
+async def run_workflow():
+    print("🧪 Testing Vietnam Reels RAG Workflow End-to-End")
+    print("=" * 60)
+
+    async with httpx.AsyncClient(base_url=BASE_URL, timeout=None) as client:
+        if not await check_models(client):
+            return
+
+        # The two streams are independent, so they run side by side
+        for report in await asyncio.gather(check_rag_stream(client), check_chat_stream(client)):
+            print("\n".join(report))
+
+        # History last: it checks what the streams above saved
+        await check_history(client)
+
     print("\n" + "=" * 60)
     print("🎉 Workflow test completed!")
 
+def test_workflow():
+    asyncio.run(run_workflow())
+
 if __name__ == "__main__":
-    test_workflow()
\ No newline at end of file
+    test_workflow()